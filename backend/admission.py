@@ -0,0 +1,158 @@
+"""
+Admission control for the safety endpoints
+Picks a service mode per request from the number of requests in flight and
+the health of each upstream provider, so overload degrades to cached or
+fallback data instead of queueing sleeping retries:
+
+    full           - normal lookups: fresh cache, then upstream with retries
+    stale          - serve cached data of any age before going upstream;
+                     upstream only on a complete miss, never retried
+    cache_only     - cached data of any age, else fallback; no upstream calls
+    fallback_only  - in-memory records of any age, else fallback; no file
+                     reads and no upstream calls
+
+Beyond ADMISSION_SHED_INFLIGHT requests are rejected with 503 + Retry-After.
+A provider that fails UPSTREAM_FAILURE_THRESHOLD times in a row (429, 5xx,
+timeout, connection error) is skipped for UPSTREAM_COOLDOWN_S seconds, or
+for the provider's Retry-After if longer; requests are then served at least
+in stale mode.
+"""
+
+import contextvars
+import logging
+import threading
+import time
+
+from config import get_settings
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FULL = "full"
+STALE = "stale"
+CACHE_ONLY = "cache_only"
+FALLBACK_ONLY = "fallback_only"
+SHED = "shed"
+
+MODES = (FULL, STALE, CACHE_ONLY, FALLBACK_ONLY)
+SHED_RETRY_AFTER = 2  # seconds, sent with 503 responses
+
+_mode = contextvars.ContextVar("admission_mode", default=FULL)
+_lock = threading.Lock()
+_in_flight = 0
+_failures = {}        # provider -> consecutive failures
+_cooldown_until = {}  # provider -> time.monotonic() deadline
+
+
+def in_flight():
+    return _in_flight
+
+
+def _degrade(mode, at_least):
+    return max(mode, at_least, key=MODES.index)
+
+
+def choose_mode(inflight):
+    """Mode for a request admitted with ``inflight`` requests already running"""
+    settings = get_settings()
+    if inflight >= settings.admission_shed_inflight:
+        return SHED
+    if inflight >= settings.admission_fallback_inflight:
+        mode = FALLBACK_ONLY
+    elif inflight >= settings.admission_cache_only_inflight:
+        mode = CACHE_ONLY
+    elif inflight >= settings.admission_stale_inflight:
+        mode = STALE
+    else:
+        mode = FULL
+    if any(not upstream_available(provider) for provider in list(_cooldown_until)):
+        mode = _degrade(mode, STALE)
+    return mode
+
+
+def admit(endpoint):
+    """
+    Admit a request: returns its mode, or SHED if it should be rejected.
+    Admitted requests must call ``release()`` when done.
+    """
+    global _in_flight
+    with _lock:
+        mode = choose_mode(_in_flight)
+        if mode != SHED:
+            _in_flight += 1
+            metrics.IN_FLIGHT.set(value=_in_flight)
+    if mode == SHED:
+        metrics.SHED_REQUESTS.inc(endpoint)
+    else:
+        metrics.ADMITTED_REQUESTS.inc(endpoint, mode)
+        _mode.set(mode)
+    return mode
+
+
+def release():
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+        metrics.IN_FLIGHT.set(value=_in_flight)
+    _mode.set(FULL)
+
+
+def current_mode():
+    """Mode of the request running in this context (FULL outside requests)"""
+    return _mode.get()
+
+
+def upstream_available(provider):
+    """False while ``provider`` is cooling down after repeated failures"""
+    deadline = _cooldown_until.get(provider)
+    return deadline is None or time.monotonic() >= deadline
+
+
+def record_upstream(provider, ok, retry_after_s=None):
+    """Track consecutive failures per provider and start a cooldown when they add up"""
+    settings = get_settings()
+    with _lock:
+        if ok:
+            _failures[provider] = 0
+            if provider in _cooldown_until:
+                del _cooldown_until[provider]
+                metrics.UPSTREAM_COOLDOWN.set(provider, value=0)
+            return
+        failures = _failures[provider] = _failures.get(provider, 0) + 1
+        if failures >= settings.upstream_failure_threshold:
+            cooldown = max(settings.upstream_cooldown_s, retry_after_s or 0)
+            _cooldown_until[provider] = time.monotonic() + cooldown
+            metrics.UPSTREAM_COOLDOWN.set(provider, value=1)
+
+
+def may_fetch(provider):
+    """True if the current request may call ``provider`` at all"""
+    return current_mode() in (FULL, STALE) and upstream_available(provider)
+
+
+def may_retry(provider):
+    """True if the current request may sleep and retry a rate-limited call"""
+    return current_mode() == FULL and upstream_available(provider)
+
+
+def read_cache(cache, lat, lon, provider):
+    """
+    Cache lookup for the current mode.
+
+    Returns ``(record, may_fetch)``: a record to serve (possibly stale) or
+    None, and whether the caller may go upstream for a missing record.
+    """
+    mode = current_mode()
+    if mode != FALLBACK_ONLY:
+        record, layer = cache.get(lat, lon)
+        if record is not None:
+            logger.debug("Using %s cached %s data for (%s, %s)", layer, cache.name, lat, lon)
+            return record, False
+        if mode == FULL and upstream_available(provider):
+            return None, True
+    # get() above already merged the file into memory
+    record = cache.get_stale(lat, lon)
+    if record is not None:
+        logger.debug("Using stale cached %s data for (%s, %s) in %s mode", cache.name, lat, lon, mode)
+        return record, False
+    return None, may_fetch(provider)
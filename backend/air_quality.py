@@ -4,99 +4,104 @@ Fetches real data from WAQI (World Air Quality Index) API
 Falls back gracefully if API is unavailable or token not configured
 """
 
-import requests
-from datetime import datetime, timedelta
-import os
-from pathlib import Path
-import json
+from datetime import datetime
 import time
+from cache_store import RecordCache, cache_key, cache_time
+from config import get_settings
+from metrics import FALLBACKS_SERVED, UPSTREAM_RETRIES
+import admission
+import upstream
+import timing
+import logging
 
-# Load environment variables from .env file
-env_path = Path(__file__).parent / ".env"
-if env_path.exists():
-    with open(env_path) as f:
-        for line in f:
-            line = line.strip()
-            if line and not line.startswith("#") and "=" in line:
-                key, value = line.split("=", 1)
-                os.environ[key.strip()] = value.strip()
+logger = logging.getLogger(__name__)
 
-WAQI_TOKEN = os.getenv("WAQI_TOKEN", "").strip()
-WAQI_API_BASE = "https://api.waqi.info"
+PROVIDER = "waqi"
 
-# Use in-memory cache with fallback to file cache
-MEMORY_CACHE = {}
 CACHE_TTL = 3600  # 1 hour (increased from 10 minutes)
 CACHE_FILE = "aqi_cache.json"  # Use relative path instead of /tmp/
 
-def load_aqi_cache():
-    """Load cache from file"""
-    try:
-        if os.path.exists(CACHE_FILE):
-            with open(CACHE_FILE, 'r') as f:
-                data = json.load(f)
-                MEMORY_CACHE.update(data)
-                return data
-    except Exception as e:
-        print(f"Error loading AQI cache: {e}")
-    return {}
 
-def save_aqi_cache(cache):
-    """Save cache to file"""
-    try:
-        with open(CACHE_FILE, 'w') as f:
-            json.dump(cache, f)
-    except Exception as e:
-        print(f"Error saving AQI cache: {e}")
+# Fallback reasons that describe the location rather than a failed lookup
+NO_DATA_REASONS = ("not_configured", "no_data")
 
-def get_cached_aqi_data(lat, lon):
-    """Get AQI data from cache if available and not expired"""
-    cache_key = f"{round(lat, 2)},{round(lon, 2)}"
-    
-    # Try memory cache first (faster)
-    if cache_key in MEMORY_CACHE:
-        cache_entry = MEMORY_CACHE[cache_key]
-        if isinstance(cache_entry, dict):
-            data = cache_entry.get('data')
-            timestamp = cache_entry.get('timestamp')
-            age = datetime.now() - datetime.fromisoformat(timestamp)
-            if age < timedelta(seconds=CACHE_TTL):
-                print(f"Using cached AQI data for ({lat}, {lon}) - age: {age.seconds}s")
-                return data
-    
-    # Try file cache if memory cache miss
-    try:
-        cache = load_aqi_cache()
-        if cache_key in cache:
-            cache_entry = cache[cache_key]
-            if isinstance(cache_entry, dict):
-                data = cache_entry.get('data')
-                timestamp = cache_entry.get('timestamp')
-                age = datetime.now() - datetime.fromisoformat(timestamp)
-                # Allow returning file cache even if slightly expired (up to 2x TTL)
-                if age < timedelta(seconds=CACHE_TTL * 2):
-                    print(f"Using file cached AQI data for ({lat}, {lon}) - age: {age.seconds}s")
-                    return data
-    except Exception as e:
-        print(f"Error checking file cache: {e}")
-    
-    return None
 
-def cache_aqi_data(lat, lon, data):
-    """Cache AQI data in memory and file"""
-    cache_key = f"{round(lat, 2)},{round(lon, 2)}"
-    timestamp = datetime.now().isoformat()
-    
-    # Save to memory cache
-    MEMORY_CACHE[cache_key] = {'data': data, 'timestamp': timestamp}
-    
-    # Save to file cache
+class AQIRecord:
+    """
+    Nearest-station pollutant readings used for scoring, plus fetch time
+    (epoch seconds). ``fallback`` marks empty records served because a lookup
+    failed or was skipped under load (not because the location has no data).
+    """
+
+    __slots__ = ("location_name", "lat", "lon", "aqi", "pm25", "pm10", "no2", "o3", "data_available", "ts", "fallback")
+
+    def __init__(self, location_name, lat, lon, aqi, pm25, pm10, no2, o3, data_available, ts, fallback=False):
+        self.location_name = location_name
+        self.lat = lat
+        self.lon = lon
+        self.aqi = aqi
+        self.pm25 = pm25
+        self.pm10 = pm10
+        self.no2 = no2
+        self.o3 = o3
+        self.data_available = data_available
+        self.ts = ts
+        self.fallback = fallback
+
+    @property
+    def has_measurements(self):
+        return self.data_available and any(
+            v is not None for v in (self.aqi, self.pm25, self.pm10, self.no2, self.o3)
+        )
+
+    @classmethod
+    def from_row(cls, row):
+        ts, location_name, lat, lon, aqi, pm25, pm10, no2, o3 = row
+        return cls(location_name, lat, lon, aqi, pm25, pm10, no2, o3, True, ts)
+
+    def to_row(self):
+        return [self.ts, self.location_name, self.lat, self.lon, self.aqi, self.pm25, self.pm10, self.no2, self.o3]
+
+
+# In-memory cache with fallback to file cache
+AQI_CACHE = RecordCache("aqi", CACHE_FILE, AQIRecord, CACHE_TTL)
+
+def cache_aqi_data(lat, lon, record):
+    """Cache AQI record in memory and file"""
+    AQI_CACHE.put(lat, lon, record)
+
+def waqi_configured():
+    """True if AQI lookups can reach WAQI (token set, or replaying an archive)"""
+    return upstream.mode() == "replay" or get_settings().waqi_configured
+
+def get_aqi_data_version(lat, lon):
+    """
+    Version of the AQI input for a location: the cached record's timestamp,
+    a constant when WAQI is not configured, or None if nothing fresh is cached.
+    """
+    if not waqi_configured():
+        return "unconfigured"
+    record = AQI_CACHE.peek(lat, lon)
+    return aqi_data_version(record) if record is not None else None
+
+def aqi_data_version(record):
+    """Version of the AQI input ``record``, matching get_aqi_data_version for a cached one"""
+    return repr(record.ts) if waqi_configured() else "unconfigured"
+
+def aqi_input_version(record):
+    """
+    Tag for the AQI readings a score was computed from. Records without
+    measurements all score the same, so they share one tag.
+    """
+    return repr(record.ts) if record.has_measurements else "none"
+
+def _pollutant_value(iaqi, name):
+    """Read a WAQI iaqi pollutant value as float, or None"""
     try:
-        cache = load_aqi_cache()
-        cache[cache_key] = {'data': data, 'timestamp': timestamp}
-        save_aqi_cache(cache)
-    except Exception as e:
-        print(f"Error caching AQI data: {e}")
+        value = iaqi.get(name, {}).get("v")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError, AttributeError):
+        return None
 
 # Try multiple AQI data sources
 def get_air_quality_data(lat, lon, retry=0, max_retries=3):
@@ -111,123 +116,91 @@ def get_air_quality_data(lat, lon, retry=0, max_retries=3):
         max_retries (int): Maximum retry attempts
     
     Returns:
-        dict: Air quality data or fallback dict if unavailable
+        AQIRecord: Normalized air quality readings or fallback record if unavailable
     """
-    # Try cache first
-    cached = get_cached_aqi_data(lat, lon)
+    # Try cache first; under load or upstream trouble this may be stale data
+    cached, may_fetch = admission.read_cache(AQI_CACHE, lat, lon, PROVIDER)
     if cached:
         return cached
+    if not may_fetch:
+        return get_aqi_fallback(lat, lon, "degraded" if waqi_configured() else "not_configured")
     
     try:
-        if not WAQI_TOKEN or WAQI_TOKEN == "YOUR_WAQI_API_TOKEN_HERE":
-            print(f"WAQI_TOKEN not configured. Using graceful fallback.")
-            return get_aqi_fallback(lat, lon)
+        if not waqi_configured():
+            logger.debug("WAQI_TOKEN not configured. Using graceful fallback.")
+            return get_aqi_fallback(lat, lon, "not_configured")
         
         # Call WAQI Geo API to find nearest station
-        url = f"{WAQI_API_BASE}/feed/geo:{lat};{lon}/?token={WAQI_TOKEN}"
+        settings = get_settings()
+        url = f"{settings.waqi_api_base}/feed/geo:{lat};{lon}/?token={settings.waqi_token}"
         
-        response = requests.get(url, timeout=8)
+        response = upstream.fetch(PROVIDER, url, timeout=8, key=cache_key(lat, lon))
         
         # Handle rate limiting with retry
         if response.status_code == 429:
-            if retry < max_retries:
+            if retry < max_retries and admission.may_retry(PROVIDER):
                 wait_time = (2 ** retry) + 1  # Exponential backoff: 2, 4, 8 seconds
-                print(f"Rate limited on AQI API, retrying in {wait_time}s (attempt {retry+1}/{max_retries})")
-                time.sleep(wait_time)
+                logger.warning("Rate limited on AQI API, retrying in %ss (attempt %s/%s)", wait_time, retry + 1, max_retries)
+                UPSTREAM_RETRIES.inc(PROVIDER)
+                with timing.stage("retry_wait"):
+                    time.sleep(wait_time)
                 return get_air_quality_data(lat, lon, retry=retry+1, max_retries=max_retries)
             else:
-                print(f"Max retries exceeded for AQI API at ({lat}, {lon})")
-                return get_aqi_fallback(lat, lon)
+                logger.warning("Max retries exceeded for AQI API at (%s, %s)", lat, lon)
+                return get_aqi_fallback(lat, lon, "rate_limited")
         
         response.raise_for_status()
         
         data = response.json()
         
         if data.get("status") == "error":
-            print(f"WAQI API error: {data.get('data')}")
-            return get_aqi_fallback(lat, lon)
+            logger.warning("WAQI API error: %s", data.get('data'))
+            return get_aqi_fallback(lat, lon, "error")
         
         if data.get("status") != "ok" or not data.get("data"):
-            return get_aqi_fallback(lat, lon)
+            return get_aqi_fallback(lat, lon, "no_data")
         
         station_data = data.get("data", {})
-        
-        # Extract measurements
-        measurements = []
-        if station_data.get("aqi"):
-            measurements.append({
-                "parameter": "aqi",
-                "lastValue": station_data.get("aqi")
-            })
-        
-        # Extract pollutant data
+        city = station_data.get("city", {})
+        geo = city.get("geo") or [lat, lon]
         iaqi = station_data.get("iaqi", {})
-        pollutants = {
-            "pm25": "pm25",
-            "pm10": "pm10",
-            "o3": "o3",
-            "no2": "no2",
-            "so2": "so2",
-            "co": "co"
-        }
-        
-        for waqi_key, param_name in pollutants.items():
-            if waqi_key in iaqi:
-                measurements.append({
-                    "parameter": param_name,
-                    "lastValue": iaqi[waqi_key].get("v")
-                })
-        
-        result_data = {
-            "location_name": station_data.get("city", {}).get("name", "Unknown Station"),
-            "lat": station_data.get("city", {}).get("geo", [lat, lon])[0],
-            "lon": station_data.get("city", {}).get("geo", [lat, lon])[1],
-            "measurements": measurements,
-            "last_updated": datetime.now().isoformat(),
-            "data_available": True,
-            "aqi": station_data.get("aqi"),
-            "dominentpol": station_data.get("dominentpol", ""),
-            "time": station_data.get("time", {}).get("iso", "")
-        }
-        cache_aqi_data(lat, lon, result_data)
-        return result_data
+        aqi = station_data.get("aqi")
+
+        record = AQIRecord(
+            city.get("name", "Unknown Station"),
+            geo[0],
+            geo[1],
+            aqi if isinstance(aqi, (int, float)) else None,
+            _pollutant_value(iaqi, "pm25"),
+            _pollutant_value(iaqi, "pm10"),
+            _pollutant_value(iaqi, "no2"),
+            _pollutant_value(iaqi, "o3"),
+            True,
+            cache_time()
+        )
+        cache_aqi_data(lat, lon, record)
+        return record
     
-    except requests.exceptions.Timeout:
-        print(f"WAQI API timeout for ({lat}, {lon})")
-        return get_aqi_fallback(lat, lon)
-    except requests.exceptions.ConnectionError:
-        print(f"WAQI API connection error for ({lat}, {lon})")
-        return get_aqi_fallback(lat, lon)
+    except upstream.UpstreamTimeout:
+        logger.warning("WAQI API timeout for (%s, %s)", lat, lon)
+        return get_aqi_fallback(lat, lon, "timeout")
+    except upstream.UpstreamConnectionError:
+        logger.warning("WAQI API connection error for (%s, %s)", lat, lon)
+        return get_aqi_fallback(lat, lon, "connection_error")
     except Exception as e:
-        print(f"Air quality data error for ({lat}, {lon}): {e}")
-        return get_aqi_fallback(lat, lon)
+        logger.warning("Air quality data error for (%s, %s): %s", lat, lon, e)
+        return get_aqi_fallback(lat, lon, "error")
 
-def get_aqi_fallback(lat, lon):
+def get_aqi_fallback(lat, lon, reason="unavailable"):
     """
     Fallback graceful response when WAQI API is unavailable
     Allows system to continue working with weather-only scoring
     """
-    return {
-        "location_name": "Unknown Station",
-        "lat": lat,
-        "lon": lon,
-        "measurements": [],
-        "last_updated": datetime.now().isoformat(),
-        "data_available": False,
-        "message": "WAQI data unavailable"
-    }
-
-def extract_pollutant_value(measurements, pollutant_name):
-    """
-    Extract specific pollutant value from measurements.
-    """
-    try:
-        for measurement in measurements:
-            if measurement.get("parameter") == pollutant_name:
-                return float(measurement.get("lastValue"))
-        return None
-    except Exception:
-        return None
+    FALLBACKS_SERVED.inc(PROVIDER, reason)
+    return AQIRecord(
+        "Unknown Station", lat, lon, None, None, None, None, None, False, cache_time(),
+        fallback=reason not in NO_DATA_REASONS
+    )
 
 def calculate_aqi_from_pm25(pm25):
     """
@@ -329,7 +302,7 @@ def calculate_air_quality_safety_impact(pm25, pm10, no2=None, o3=None):
         }
     
     except Exception as e:
-        print(f"Air quality safety impact error: {e}")
+        logger.exception("Air quality safety impact error")
         return {
             "safety_reduction": 0,
             "details": {},
@@ -337,18 +310,22 @@ def calculate_air_quality_safety_impact(pm25, pm10, no2=None, o3=None):
             "error": str(e)
         }
 
-def get_location_air_quality_score(lat, lon):
+def get_location_air_quality_score(lat, lon, aq_data=None):
     """
     Get comprehensive air quality safety score for a location.
     Gracefully handles unavailable data.
     
+    Args:
+        aq_data (AQIRecord): Readings to score; fetched for lat/lon if omitted
+    
     Returns:
         dict: Air quality data with safety impact
     """
     try:
-        aq_data = get_air_quality_data(lat, lon)
+        if aq_data is None:
+            aq_data = get_air_quality_data(lat, lon)
         
-        if "error" in aq_data or not aq_data.get("measurements"):
+        if not aq_data.has_measurements:
             # Return neutral impact if no data available
             return {
                 "safety_score": 1.0,  # No impact if data unavailable
@@ -361,23 +338,15 @@ def get_location_air_quality_score(lat, lon):
                 "message": "Air quality data unavailable for this location"
             }
         
-        measurements = aq_data.get("measurements", [])
-        
-        # Extract pollutant values
-        pm25 = extract_pollutant_value(measurements, "pm25")
-        pm10 = extract_pollutant_value(measurements, "pm10")
-        no2 = extract_pollutant_value(measurements, "no2")
-        o3 = extract_pollutant_value(measurements, "o3")
-        
         # Calculate impact
-        impact = calculate_air_quality_safety_impact(pm25, pm10, no2, o3)
+        impact = calculate_air_quality_safety_impact(aq_data.pm25, aq_data.pm10, aq_data.no2, aq_data.o3)
         
         return {
-            "location_name": aq_data.get("location_name", "Unknown"),
-            "lat": aq_data.get("lat", lat),
-            "lon": aq_data.get("lon", lon),
-            "distance_km": aq_data.get("distance_km", 0),
-            "last_updated": aq_data.get("last_updated", "Unknown"),
+            "location_name": aq_data.location_name,
+            "lat": aq_data.lat,
+            "lon": aq_data.lon,
+            "distance_km": 0,
+            "last_updated": datetime.fromtimestamp(aq_data.ts).isoformat(),
             "safety_reduction": impact["safety_reduction"],
             "warnings": impact["warnings"],
             "pollutants": impact["details"],
@@ -385,7 +354,7 @@ def get_location_air_quality_score(lat, lon):
         }
     
     except Exception as e:
-        print(f"Location air quality score error: {e}")
+        logger.exception("Location air quality score error")
         return {
             "safety_reduction": 0,
             "warnings": [],
@@ -0,0 +1,59 @@
+"""
+Verification of the login tokens issued by the Node backend
+Tokens are HS256 JWTs signed with the shared JWT_SECRET and carry the user
+id as ``id`` (see routes/auth.js); they are checked here with the standard
+library so the safety service needs no JWT dependency.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import re
+import time
+
+# Unpadded base64url, as JWTs are encoded (RFC 7515)
+_SEGMENT = re.compile(r"[A-Za-z0-9_-]*")
+
+
+class TokenError(Exception):
+    """Missing, malformed, expired or wrongly signed token"""
+
+
+def _b64decode(segment):
+    """Decode one token segment; ValueError unless it is unpadded base64url"""
+    if not _SEGMENT.fullmatch(segment):
+        raise ValueError("segment is not unpadded base64url")
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def verify_token(token, secret):
+    """Return the claims of a valid HS256 token, else raise TokenError"""
+    if not token or not secret:
+        raise TokenError("no token")
+    if token.startswith("Bearer "):
+        token = token[len("Bearer "):]
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except (ValueError, TypeError):
+        raise TokenError("malformed token")
+    if not isinstance(header, dict) or header.get("alg") != "HS256" or not isinstance(claims, dict):
+        raise TokenError("unsupported token")
+    expected = hmac.new(secret.encode(), f"{header_b64}.{payload_b64}".encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        raise TokenError("bad signature")
+    exp = claims.get("exp")
+    if exp is not None and (isinstance(exp, bool) or not isinstance(exp, (int, float)) or exp < time.time()):
+        raise TokenError("token expired")
+    return claims
+
+
+def user_id(token, secret):
+    """User id of a valid token, else raise TokenError"""
+    uid = verify_token(token, secret).get("id")
+    if not isinstance(uid, str) or not uid:
+        raise TokenError("token has no user id")
+    return uid
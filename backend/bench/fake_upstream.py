@@ -0,0 +1,172 @@
+"""
+Local stand-in for the Open-Meteo and WAQI APIs
+Serves the payloads in bench/payloads with configurable latency, error rate
+and rate limiting (HTTP 429)
+
+The payloads are synthetic: hand-made in the shape of real responses for six
+Indian cities (Open-Meteo with only the "current" block the service
+requests), not recorded. Values are illustrative and each coordinate gets a
+payload by hash, not by nearest city, so a bench run sees a spread of
+scores. Use the record/replay archive (see replay_compare.py) for real data.
+
+Run standalone:
+    python bench/fake_upstream.py --port 8765 --latency-ms 80 --error-rate 0.01 --quota-rps 50
+then point the service at it:
+    OPEN_METEO_BASE=http://127.0.0.1:8765/v1/forecast WAQI_API_BASE=http://127.0.0.1:8765 WAQI_TOKEN=bench
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+PAYLOAD_DIR = Path(__file__).parent / "payloads"
+WAQI_GEO_PATH = re.compile(r"^/feed/geo:([-\d.]+);([-\d.]+)/?$")
+
+
+def load_payloads(name):
+    with open(PAYLOAD_DIR / f"{name}.json") as f:
+        return [json.dumps(payload).encode() for payload in json.load(f)]
+
+
+class UpstreamBehaviour:
+    """Latency, failure and quota settings shared by all handler threads"""
+
+    def __init__(self, latency_ms=50.0, jitter_ms=20.0, error_rate=0.0,
+                 rate_limit_rate=0.0, quota_rps=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.quota_rps = quota_rps
+        self.random = random.Random(seed)
+        self.calls = {"open_meteo": 0, "waqi": 0}
+        self.status_counts = {}
+        self._tokens = quota_rps
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take_quota(self):
+        """Token bucket of quota_rps requests per second (0 = unlimited)"""
+        if self.quota_rps <= 0:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.quota_rps, self._tokens + (now - self._refilled) * self.quota_rps)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def decide(self, provider):
+        """Return (status, delay_seconds) for one upstream call"""
+        with self._lock:
+            self.calls[provider] += 1
+            roll = self.random.random()
+            delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+            if not self._take_quota() or roll < self.rate_limit_rate:
+                status = 429
+            elif roll < self.rate_limit_rate + self.error_rate:
+                status = 500
+            else:
+                status = 200
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        return status, delay
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "status_counts": {str(k): v for k, v in self.status_counts.items()},
+            }
+
+
+def _pick(payloads, lat, lon):
+    """Deterministic (not location-matched) payload for a coordinate so repeated calls agree"""
+    return payloads[zlib.crc32(f"{lat:.2f},{lon:.2f}".encode()) % len(payloads)]
+
+
+def make_handler(behaviour, open_meteo, waqi):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/__stats":
+                return self._send(200, json.dumps(behaviour.stats()).encode())
+
+            if url.path == "/v1/forecast":
+                query = parse_qs(url.query)
+                provider = "open_meteo"
+                lat = float(query.get("latitude", ["0"])[0])
+                lon = float(query.get("longitude", ["0"])[0])
+                payloads = open_meteo
+            else:
+                match = WAQI_GEO_PATH.match(url.path)
+                if not match:
+                    return self._send(404, b'{"error":"not found"}')
+                provider = "waqi"
+                lat, lon = float(match.group(1)), float(match.group(2))
+                payloads = waqi
+
+            status, delay = behaviour.decide(provider)
+            time.sleep(delay)
+            if status == 200:
+                self._send(200, _pick(payloads, lat, lon))
+            elif status == 429:
+                self._send(429, b'{"error":"Too many requests"}')
+            else:
+                self._send(status, b'{"error":"Internal error"}')
+
+    return Handler
+
+
+def start(port=0, behaviour=None):
+    """Start the fake upstream on a background thread; returns (server, behaviour)"""
+    behaviour = behaviour or UpstreamBehaviour()
+    handler = make_handler(behaviour, load_payloads("open_meteo"), load_payloads("waqi"))
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-upstream", daemon=True).start()
+    return server, behaviour
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Open-Meteo/WAQI upstream")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--quota-rps", type=float, default=0.0, help="429 once this request rate is exceeded (0 = off)")
+    args = parser.parse_args()
+
+    behaviour = UpstreamBehaviour(args.latency_ms, args.jitter_ms, args.error_rate,
+                                  args.rate_limit_rate, args.quota_rps)
+    server, _ = start(args.port, behaviour)
+    print(f"Fake upstream listening on http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Replay recorded traffic against the service offline and compare runs
+Uses an archive written with UPSTREAM_MODE=record: upstream responses are
+served from the archive and inbound requests come from its traffic log
+
+Cache expiry follows the timestamps in the traffic log rather than the wall
+clock, so cells are refetched (and get their next recording) when they were
+refetched while recording. Trip ids are dropped from replayed bodies (older
+archives recorded them), so a replay never writes trip history.
+
+A changed HTTP status counts as a status change when comparing runs.
+
+Example:
+    # on a recording instance
+    UPSTREAM_MODE=record UPSTREAM_ARCHIVE=/data/day1 python server.py
+    # later, offline
+    python bench/replay_compare.py --archive /data/day1 --out before.jsonl
+    python bench/replay_compare.py --archive /data/day1 --out after.jsonl --baseline before.jsonl
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from run_bench import percentile  # noqa: E402
+
+
+def summarize(endpoint, data):
+    """Fields compared between runs"""
+    if endpoint.endswith("/route_safety"):
+        return {
+            "route_status": data.get("route_status"),
+            "average_safety": data.get("average_safety"),
+            "scores": [wp.get("safety_score") for wp in data.get("waypoints", [])],
+        }
+    return {"status": data.get("status"), "scores": [data.get("safety_score")]}
+
+
+def replay(args):
+    os.environ["UPSTREAM_MODE"] = "replay"
+    os.environ["UPSTREAM_ARCHIVE"] = os.path.abspath(args.archive)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    traffic_path = os.path.abspath(args.traffic or f"{args.archive}.traffic.jsonl")
+
+    # Start from empty caches so every run sees the same upstream sequence
+    os.chdir(tempfile.mkdtemp(prefix="safesafar-replay-"))
+    import server
+    import cache_store
+    import upstream
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    client = server.app.test_client()
+    results = []
+    with open(traffic_path) as f:
+        for i, line in enumerate(f):
+            if args.limit and i >= args.limit:
+                break
+            entry = json.loads(line)
+            recorded_at = entry.get("ts")
+            cache_store.set_cache_clock((lambda ts=recorded_at: ts) if recorded_at is not None else None)
+            start = time.perf_counter()
+            response = client.post(entry["endpoint"], json=upstream.replayable_body(entry["body"]))
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            data = response.get_json(silent=True) or {}
+            results.append({
+                "i": i,
+                "endpoint": entry["endpoint"],
+                "http_status": response.status_code,
+                "latency_ms": round(elapsed_ms, 3),
+                "summary": summarize(entry["endpoint"], data),
+            })
+    return results
+
+
+def compare(results, baseline, tolerance):
+    by_index = {r["i"]: r for r in baseline}
+    changed_status = 0
+    changed_http = 0
+    changed_scores = 0
+    max_diff = 0.0
+    for result in results:
+        base = by_index.get(result["i"])
+        if base is None:
+            continue
+        a, b = result["summary"], base["summary"]
+        http_changed = result["http_status"] != base["http_status"]
+        changed_http += http_changed
+        if http_changed or a.get("status") != b.get("status") or a.get("route_status") != b.get("route_status"):
+            changed_status += 1
+        diffs = [abs((x or 0) - (y or 0)) for x, y in zip(a["scores"], b["scores"])]
+        if len(a["scores"]) != len(b["scores"]) or any(d > tolerance for d in diffs):
+            changed_scores += 1
+        if diffs:
+            max_diff = max(max_diff, max(diffs))
+    return {"compared": len(results), "status_changed": changed_status, "http_status_changed": changed_http,
+            "scores_changed": changed_scores, "max_score_diff": round(max_diff, 6)}
+
+
+def latency_stats(results):
+    values = sorted(r["latency_ms"] for r in results)
+    total = sum(values)
+    return {
+        "requests": len(values),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "replay_rps": round(len(values) / (total / 1000), 1) if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded traffic and compare outputs/latency")
+    parser.add_argument("--archive", required=True, help="archive path prefix (UPSTREAM_ARCHIVE)")
+    parser.add_argument("--traffic", help="traffic log (default <archive>.traffic.jsonl)")
+    parser.add_argument("--out", help="write per-request results as JSON lines")
+    parser.add_argument("--baseline", help="results from a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="score difference counted as a change")
+    parser.add_argument("--limit", type=int, default=0)
+    args = parser.parse_args()
+    out = os.path.abspath(args.out) if args.out else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    results = replay(args)
+    print("latency:", json.dumps(latency_stats(results)))
+
+    if out:
+        with open(out, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = [json.loads(line) for line in f]
+        print("baseline latency:", json.dumps(latency_stats(baseline)))
+        print("outputs:", json.dumps(compare(results, baseline, args.tolerance)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Offline load benchmark for the safety service
+Starts the fake upstream and the Flask app locally, drives /safety_score and
+/route_safety with a mix of routes of varying size and overlap, and reports
+latency percentiles, throughput, upstream calls per request and cache hit rate
+
+Example:
+    python bench/run_bench.py --requests 500 --concurrency 16 --overlap 0.7
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fake_upstream  # noqa: E402
+
+# Default workload region (Delhi NCR)
+REGION = (28.40, 76.85, 28.90, 77.45)
+METRIC_LINE = re.compile(r'^(\w+)\{([^}]*)\} ([-\d.e+]+)$')
+
+
+def random_route(rng, min_points, max_points):
+    """Waypoints along a jittered straight line inside REGION"""
+    lat_min, lon_min, lat_max, lon_max = REGION
+    n = rng.randint(min_points, max_points)
+    start = (rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max))
+    end = (rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max))
+    points = []
+    for i in range(n):
+        t = i / max(1, n - 1)
+        points.append({
+            "lat": round(start[0] + (end[0] - start[0]) * t + rng.uniform(-0.005, 0.005), 5),
+            "lon": round(start[1] + (end[1] - start[1]) * t + rng.uniform(-0.005, 0.005), 5),
+            "name": f"Point {i + 1}",
+        })
+    return points
+
+
+def build_workload(args):
+    """
+    List of (endpoint, body). A fraction ``overlap`` of requests reuse a small
+    pool of hot routes/positions; the rest are fresh.
+    """
+    rng = random.Random(args.seed)
+    hot_routes = [random_route(rng, args.min_points, args.max_points) for _ in range(args.hot_routes)]
+    workload = []
+    for _ in range(args.requests):
+        reuse = rng.random() < args.overlap
+        if rng.random() < args.route_share:
+            route = rng.choice(hot_routes) if reuse else random_route(rng, args.min_points, args.max_points)
+            workload.append(("/route_safety", {"waypoints": route}))
+        else:
+            if reuse:
+                point = rng.choice(rng.choice(hot_routes))
+            else:
+                point = random_route(rng, 1, 1)[0]
+            workload.append(("/safety_score", {"lat": point["lat"], "lon": point["lon"]}))
+    return workload
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+def parse_metrics(text):
+    """{(name, labels_str): value} for labelled samples"""
+    samples = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            samples[(match.group(1), match.group(2))] = float(match.group(3))
+    return samples
+
+
+def cache_hit_rates(samples):
+    """Fraction of lookups served from any cache layer, per cache"""
+    totals = {}
+    for (name, labels), value in samples.items():
+        if name != "safesafar_cache_lookups_total":
+            continue
+        fields = dict(re.findall(r'(\w+)="([^"]*)"', labels))
+        entry = totals.setdefault(fields["cache"], {"lookups": 0.0, "hits": 0.0})
+        if fields["layer"] == "memory":
+            entry["lookups"] += value
+        if fields["result"] == "hit":
+            entry["hits"] += value
+    return {cache: (v["hits"] / v["lookups"] if v["lookups"] else 0.0) for cache, v in totals.items()}
+
+
+def start_service():
+    """Import the app (after env is configured) and serve it on a local port"""
+    from werkzeug.serving import make_server
+    import server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    http_server = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, name="bench-service", daemon=True).start()
+    return http_server
+
+
+def run(args):
+    behaviour = fake_upstream.UpstreamBehaviour(
+        args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate, args.quota_rps, seed=args.seed
+    )
+    upstream_server, behaviour = fake_upstream.start(0, behaviour)
+    upstream_url = f"http://127.0.0.1:{upstream_server.server_port}"
+
+    os.environ["OPEN_METEO_BASE"] = f"{upstream_url}/v1/forecast"
+    os.environ["WAQI_API_BASE"] = upstream_url
+    os.environ["WAQI_TOKEN"] = "bench"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    # Keep cache files out of the working tree and start cold
+    workdir = tempfile.mkdtemp(prefix="safesafar-bench-")
+    os.chdir(workdir)
+
+    service = start_service()
+    base_url = f"http://127.0.0.1:{service.server_port}"
+
+    workload = build_workload(args)
+    latencies = {"/safety_score": [], "/route_safety": []}
+    errors = [0]
+    lock = threading.Lock()
+    local = threading.local()
+
+    def issue(item):
+        endpoint, body = item
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.post(base_url + endpoint, json=body, timeout=120)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies[endpoint].append(elapsed)
+            if not ok:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(issue, workload))
+    wall = time.perf_counter() - started
+
+    samples = parse_metrics(requests.get(base_url + "/metrics", timeout=10).text)
+    upstream_stats = behaviour.stats()
+    service.shutdown()
+    upstream_server.shutdown()
+
+    total_requests = len(workload)
+    upstream_calls = sum(upstream_stats["calls"].values())
+    waypoint_lookups = sum(len(body["waypoints"]) if "waypoints" in body else 1 for _, body in workload)
+    report = {
+        "requests": total_requests,
+        "errors": errors[0],
+        "concurrency": args.concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(total_requests / wall, 2) if wall else 0.0,
+        "endpoints": {},
+        "upstream_calls": upstream_stats["calls"],
+        "upstream_status_counts": upstream_stats["status_counts"],
+        "upstream_calls_per_request": round(upstream_calls / total_requests, 3) if total_requests else 0.0,
+        "upstream_calls_per_location": round(upstream_calls / waypoint_lookups, 3) if waypoint_lookups else 0.0,
+        "cache_hit_rate": {cache: round(rate, 3) for cache, rate in cache_hit_rates(samples).items()},
+    }
+    for endpoint, values in latencies.items():
+        values.sort()
+        report["endpoints"][endpoint] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"requests: {report['requests']}  errors: {report['errors']}  concurrency: {report['concurrency']}")
+    print(f"wall: {report['wall_seconds']}s  throughput: {report['throughput_rps']} req/s")
+    for endpoint, stats in report["endpoints"].items():
+        print(f"  {endpoint:<14} n={stats['count']:<5} p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+    print(f"upstream calls: {report['upstream_calls']}  statuses: {report['upstream_status_counts']}")
+    print(f"upstream calls/request: {report['upstream_calls_per_request']}  per location: {report['upstream_calls_per_location']}")
+    print(f"cache hit rate: {report['cache_hit_rate']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline SafeSafar load benchmark")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--route-share", type=float, default=0.5, help="fraction of /route_safety requests")
+    parser.add_argument("--min-points", type=int, default=5)
+    parser.add_argument("--max-points", type=int, default=40)
+    parser.add_argument("--hot-routes", type=int, default=10)
+    parser.add_argument("--overlap", type=float, default=0.6, help="fraction of requests reusing hot routes")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--quota-rps", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args()
+    if args.json:
+        # run() changes into a scratch directory for cache files
+        args.json = os.path.abspath(args.json)
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
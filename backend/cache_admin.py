@@ -0,0 +1,125 @@
+"""
+Inspection and bulk invalidation of the service caches
+Backs the /admin/caches endpoints; all functions work on live caches and
+need no restart.
+
+Invalidation filters (combined with AND; at least one is required):
+    bbox         - [min_lat, min_lon, max_lat, max_lon] of cache cells
+    prefix       - cache key prefix, e.g. "28.6" for cells with lat 28.6x
+    older_than_s - entries fetched/computed more than this many seconds ago
+    all          - true to match every entry
+"""
+
+import os
+import sys
+from statistics import median
+
+from cache_store import RecordCache, cache_time, key_coordinates
+from metrics import CACHE_LOOKUPS
+
+# Upper bounds (seconds) for the entry age distribution
+AGE_BUCKETS = (300, 900, 3600, 7200, 86400)
+
+
+def approx_size(obj, _depth=0):
+    """Rough deep size in bytes of a cached value (dicts, lists, slotted records)"""
+    size = sys.getsizeof(obj)
+    if _depth > 6:
+        return size
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(approx_size(v, _depth + 1) for v in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(approx_size(getattr(obj, name, None), _depth + 1) for name in obj.__slots__)
+    return size
+
+
+def age_distribution(timestamps, now):
+    ages = sorted(now - ts for ts in timestamps)
+    buckets = {str(bound): 0 for bound in AGE_BUCKETS}
+    buckets["+Inf"] = 0
+    for age in ages:
+        for bound in AGE_BUCKETS:
+            if age <= bound:
+                buckets[str(bound)] += 1
+                break
+        else:
+            buckets["+Inf"] += 1
+    return {
+        "buckets_s": buckets,
+        "min_s": round(ages[0], 1) if ages else None,
+        "median_s": round(median(ages), 1) if ages else None,
+        "max_s": round(ages[-1], 1) if ages else None,
+    }
+
+
+def hit_rates(name):
+    """Lookup counts and hit rate per layer from the cache lookup metric"""
+    layers = {}
+    for (cache, layer, result), count in CACHE_LOOKUPS.snapshot().items():
+        if cache == name:
+            layers.setdefault(layer, {})[result] = count
+    for counts in layers.values():
+        total = sum(counts.values())
+        hits = counts.get("hit", 0) + counts.get("stale_hit", 0)
+        counts["hit_rate"] = round(hits / total, 4) if total else None
+    return layers
+
+
+def cache_stats(cache):
+    """Size, memory use, age distribution and hit rates of one cache"""
+    entries = list(cache.memory.items())
+    stats = {
+        "entries": len(entries),
+        "memory_bytes": sys.getsizeof(cache.memory) + sum(approx_size(k) + approx_size(v) for k, v in entries),
+        "age": age_distribution([ts for _, ts in cache.items()], cache_time()),
+        "lookups": hit_rates(cache.name),
+    }
+    if isinstance(cache, RecordCache):
+        stats["ttl_s"] = cache.ttl
+        try:
+            stats["file_bytes"] = os.path.getsize(cache.path)
+        except OSError:
+            stats["file_bytes"] = 0
+    return stats
+
+
+def build_predicate(filters):
+    """
+    ``predicate(key, ts)`` matching the given invalidation filters.
+    Raises ValueError for malformed or missing filters.
+    """
+    if not isinstance(filters, dict):
+        raise ValueError("request body must be a JSON object")
+    checks = []
+
+    bbox = filters.get("bbox")
+    if bbox is not None:
+        try:
+            min_lat, min_lon, max_lat, max_lon = (float(v) for v in bbox)
+        except (TypeError, ValueError):
+            raise ValueError("bbox must be [min_lat, min_lon, max_lat, max_lon]")
+
+        def in_bbox(key, ts):
+            coords = key_coordinates(key)
+            return coords is not None and min_lat <= coords[0] <= max_lat and min_lon <= coords[1] <= max_lon
+        checks.append(in_bbox)
+
+    prefix = filters.get("prefix")
+    if prefix is not None:
+        if not isinstance(prefix, str) or not prefix:
+            raise ValueError("prefix must be a non-empty string")
+        checks.append(lambda key, ts: key.startswith(prefix))
+
+    older_than = filters.get("older_than_s")
+    if older_than is not None:
+        try:
+            cutoff = cache_time() - float(older_than)
+        except (TypeError, ValueError):
+            raise ValueError("older_than_s must be a number")
+        checks.append(lambda key, ts: ts < cutoff)
+
+    if not checks and filters.get("all") is not True:
+        raise ValueError("give bbox, prefix, older_than_s or all: true")
+    return lambda key, ts: all(check(key, ts) for check in checks)
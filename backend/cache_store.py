@@ -0,0 +1,242 @@
+"""
+Compact two-layer cache (memory + JSON file) for normalized upstream records
+Records are small fixed-schema objects stored as flat rows on disk
+
+Derived results (safety scores) live in a separate memory-only ScoreCache,
+so they can be dropped without refetching the raw data they came from.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from metrics import CACHE_LOOKUPS
+import timing
+
+logger = logging.getLogger(__name__)
+
+
+_clock = time.time
+
+
+def cache_time():
+    """Current time for cache timestamps and expiry (epoch seconds)"""
+    return _clock()
+
+
+def set_cache_clock(clock=None):
+    """
+    Read cache time from ``clock()`` instead of the wall clock (None restores
+    it). Replays use this so entries expire on the recorded timeline.
+    """
+    global _clock
+    _clock = clock or time.time
+
+
+def cache_key(lat, lon):
+    """Cache cell key for a coordinate (~1km grid)"""
+    return f"{round(lat, 2)},{round(lon, 2)}"
+
+
+def key_coordinates(key):
+    """Inverse of ``cache_key``: (lat, lon) of a cell key, or None if malformed"""
+    try:
+        lat, lon = key.split(",")
+        return float(lat), float(lon)
+    except (AttributeError, ValueError):
+        return None
+
+
+class RecordCache:
+    """
+    In-memory cache of fixed-schema records with a JSON file fallback.
+
+    record_type must provide ``ts`` (epoch seconds), ``to_row()`` and a
+    ``from_row(row)`` classmethod. The file holds ``{key: row}``.
+
+    Every read-modify-write of the file, and every merge of file rows into
+    memory, happens under the cache lock, so a concurrent put or file lookup
+    cannot bring back records that invalidate() just removed.
+    """
+
+    def __init__(self, name, path, record_type, ttl):
+        self.name = name
+        self.path = path
+        self.record_type = record_type
+        self.ttl = ttl
+        self.memory = {}
+        self._lock = threading.Lock()
+
+    def _read_file(self):
+        """Records currently in the cache file (memory is not touched)"""
+        entries = {}
+        try:
+            with timing.stage("cache_io"):
+                if not os.path.exists(self.path):
+                    rows = {}
+                else:
+                    with open(self.path, 'r') as f:
+                        rows = json.load(f)
+            for key, row in rows.items():
+                # Skip entries written in the old raw-payload format
+                if isinstance(row, list):
+                    entries[key] = self.record_type.from_row(row)
+        except Exception as e:
+            logger.warning("Error loading cache %s: %s", self.path, e)
+        return entries
+
+    def load_file(self):
+        """
+        Load all rows from the cache file into the memory layer. A file row
+        only replaces a memory record that is older than it.
+        """
+        with self._lock:
+            entries = self._read_file()
+            for key, record in entries.items():
+                current = self.memory.get(key)
+                if current is None or current.ts < record.ts:
+                    self.memory[key] = record
+        return entries
+
+    def save_file(self, entries):
+        """Write records to the cache file as compact rows (caller holds the lock)"""
+        try:
+            rows = {key: record.to_row() for key, record in entries.items()}
+            # Write then rename so concurrent readers never see a partial file
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with timing.stage("cache_io"):
+                with open(tmp_path, 'w') as f:
+                    json.dump(rows, f, separators=(",", ":"))
+                os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning("Error saving cache %s: %s", self.path, e)
+
+    def get(self, lat, lon):
+        """
+        Return (record, layer) for a fresh entry, or (None, None).
+
+        Memory entries are served up to TTL; file entries up to 2x TTL.
+        """
+        key = cache_key(lat, lon)
+        now = cache_time()
+
+        record = self.memory.get(key)
+        if record is None:
+            CACHE_LOOKUPS.inc(self.name, "memory", "miss")
+        elif now - record.ts < self.ttl:
+            CACHE_LOOKUPS.inc(self.name, "memory", "hit")
+            return record, "memory"
+        else:
+            CACHE_LOOKUPS.inc(self.name, "memory", "stale")
+
+        try:
+            record = self.load_file().get(key)
+            if record is None:
+                CACHE_LOOKUPS.inc(self.name, "file", "miss")
+            # Allow returning file cache even if slightly expired (up to 2x TTL)
+            elif now - record.ts < self.ttl * 2:
+                CACHE_LOOKUPS.inc(self.name, "file", "hit")
+                return record, "file"
+            else:
+                CACHE_LOOKUPS.inc(self.name, "file", "stale")
+        except Exception as e:
+            logger.warning("Error checking file cache %s: %s", self.path, e)
+
+        return None, None
+
+    def peek(self, lat, lon):
+        """Fresh memory-layer record without touching the file or metrics, or None"""
+        record = self.memory.get(cache_key(lat, lon))
+        if record is not None and cache_time() - record.ts < self.ttl:
+            return record
+        return None
+
+    def get_stale(self, lat, lon):
+        """Memory-layer record of any age, or None (for degraded service modes)"""
+        record = self.memory.get(cache_key(lat, lon))
+        CACHE_LOOKUPS.inc(self.name, "memory", "stale_hit" if record is not None else "miss")
+        return record
+
+    def put(self, lat, lon, record):
+        """Cache a record in memory and file"""
+        key = cache_key(lat, lon)
+        with self._lock:
+            self.memory[key] = record
+            try:
+                entries = self._read_file()
+                entries[key] = record
+                self.save_file(entries)
+            except Exception as e:
+                logger.warning("Error caching data in %s: %s", self.path, e)
+
+    def items(self):
+        """Snapshot of (key, ts) for every record in memory"""
+        with self._lock:
+            return [(key, record.ts) for key, record in self.memory.items()]
+
+    def invalidate(self, predicate):
+        """
+        Drop every record for which ``predicate(key, ts)`` is true from both
+        layers. Returns the number of records removed.
+        """
+        with self._lock:
+            entries = self._read_file()
+            doomed = {key for key, record in self.memory.items() if predicate(key, record.ts)}
+            doomed.update(key for key, record in entries.items() if predicate(key, record.ts))
+            for key in doomed:
+                self.memory.pop(key, None)
+            if any(key in entries for key in doomed):
+                self.save_file({key: record for key, record in entries.items() if key not in doomed})
+        return len(doomed)
+
+
+class ScoreCache:
+    """
+    Memory-only cache of derived results, one entry per cache cell.
+
+    Each entry is tagged with the version of the inputs it was computed
+    from; a lookup only hits when the caller's tag matches, so new raw data
+    or a SCORING_VERSION bump simply misses and the entry is overwritten.
+    The oldest entries are dropped beyond ``max_entries``. ``generation``
+    goes up on every invalidation, so validators built from it (ETags)
+    change with it.
+    """
+
+    def __init__(self, name, max_entries):
+        self.name = name
+        self.max_entries = max_entries
+        self.memory = {}  # key -> (tag, value, ts)
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, lat, lon, tag):
+        entry = self.memory.get(cache_key(lat, lon))
+        if entry is not None and entry[0] == tag:
+            CACHE_LOOKUPS.inc(self.name, "memory", "hit")
+            return entry[1]
+        CACHE_LOOKUPS.inc(self.name, "memory", "miss" if entry is None else "stale")
+        return None
+
+    def put(self, lat, lon, tag, value):
+        key = cache_key(lat, lon)
+        with self._lock:
+            self.memory.pop(key, None)
+            self.memory[key] = (tag, value, cache_time())
+            while len(self.memory) > self.max_entries:
+                del self.memory[next(iter(self.memory))]
+
+    def items(self):
+        """Snapshot of (key, ts) for every entry"""
+        with self._lock:
+            return [(key, entry[2]) for key, entry in self.memory.items()]
+
+    def invalidate(self, predicate):
+        """Drop every entry for which ``predicate(key, ts)`` is true; returns the count"""
+        with self._lock:
+            doomed = [key for key, entry in self.memory.items() if predicate(key, entry[2])]
+            for key in doomed:
+                del self.memory[key]
+            self.generation += 1
+        return len(doomed)
@@ -0,0 +1,86 @@
+"""
+Service configuration, read once into a typed settings object
+Values come from the process environment, then backend/.env, then defaults.
+The .env file is parsed without modifying os.environ.
+"""
+
+import os
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from pathlib import Path
+
+ENV_FILE = Path(__file__).parent / ".env"
+
+
+@dataclass(frozen=True)
+class Settings:
+    frontend_url: str = "https://safe-safar-deploy.vercel.app"
+    log_level: str = "INFO"
+    waqi_token: str = ""
+    waqi_api_base: str = "https://api.waqi.info"
+    open_meteo_base: str = "https://api.open-meteo.com/v1/forecast"
+    upstream_mode: str = "live"
+    upstream_archive: str = "upstream_archive"
+    profile_slow_requests: bool = False
+    profile_threshold_ms: float = 1000.0
+    profile_interval_ms: float = 5.0
+    profile_dir: str = "profiles"
+    trip_history_max_trips: int = 4096
+    trip_history_points: int = 1024
+    trip_history_trips_per_user: int = 20
+    jwt_secret: str = ""
+    admission_stale_inflight: int = 8
+    admission_cache_only_inflight: int = 16
+    admission_fallback_inflight: int = 32
+    admission_shed_inflight: int = 64
+    upstream_failure_threshold: int = 3
+    upstream_cooldown_s: float = 30.0
+    admin_token: str = ""
+    score_cache_max_entries: int = 5000
+
+    @property
+    def waqi_configured(self):
+        return bool(self.waqi_token) and self.waqi_token != "YOUR_WAQI_API_TOKEN_HERE"
+
+
+def read_env_file(path=ENV_FILE):
+    """Parse KEY=VALUE lines from a .env file into a dict"""
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#") and "=" in line:
+                    key, value = line.split("=", 1)
+                    values[key.strip()] = value.strip()
+    except FileNotFoundError:
+        pass
+    return values
+
+
+def _parse(field_type, raw):
+    if field_type is bool:
+        return raw.strip().lower() in ("1", "true", "yes")
+    if field_type is int:
+        return int(raw)
+    if field_type is float:
+        return float(raw)
+    return raw.strip()
+
+
+@lru_cache(maxsize=None)
+def get_settings():
+    """Settings for this process (environment variables override .env)"""
+    file_values = read_env_file()
+    overrides = {}
+    for name, field in Settings.__dataclass_fields__.items():
+        key = name.upper()
+        raw = os.environ.get(key, file_values.get(key))
+        if raw is not None:
+            overrides[name] = _parse(field.type, raw)
+    settings = Settings(**overrides)
+    return replace(
+        settings,
+        log_level=settings.log_level.upper(),
+        upstream_mode=settings.upstream_mode.lower(),
+    )
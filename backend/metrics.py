@@ -0,0 +1,179 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition
+Counters, gauges and histograms keyed by label values; no external dependencies
+"""
+
+import threading
+from bisect import bisect_left
+
+# Upper bounds (seconds) for latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_REGISTRY = []
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{str(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def snapshot(self):
+        """Copy of the current values keyed by label tuple"""
+        with self._lock:
+            return dict(self._values)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        lines = self._header()
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def collect(self):
+        lines = self._header()
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [per-bucket counts..., +Inf count, sum]
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[idx] += 1
+            state[-1] += value
+
+    def collect(self):
+        lines = self._header()
+        with self._lock:
+            items = [(labels, list(state)) for labels, state in self._values.items()]
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', bound))} {cumulative}"
+                )
+            cumulative += state[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {state[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def render():
+    """Render all registered metrics in Prometheus text format"""
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# Shared service metrics
+REQUEST_LATENCY = Histogram(
+    "safesafar_request_duration_seconds", "Request latency per endpoint",
+    ("endpoint", "method", "status")
+)
+UPSTREAM_LATENCY = Histogram(
+    "safesafar_upstream_duration_seconds", "Upstream API call latency per provider",
+    ("provider", "status")
+)
+UPSTREAM_RETRIES = Counter(
+    "safesafar_upstream_retries_total", "Upstream retries after rate limiting", ("provider",)
+)
+UPSTREAM_RATE_LIMITED = Counter(
+    "safesafar_upstream_rate_limited_total", "Upstream HTTP 429 responses", ("provider",)
+)
+FALLBACKS_SERVED = Counter(
+    "safesafar_fallbacks_served_total", "Fallback data served instead of upstream data",
+    ("provider", "reason")
+)
+CACHE_LOOKUPS = Counter(
+    "safesafar_cache_lookups_total", "Cache lookups per cache and layer by result (hit/miss/stale/stale_hit)",
+    ("cache", "layer", "result")
+)
+NOT_MODIFIED = Counter(
+    "safesafar_not_modified_total", "Conditional requests answered with 304", ("endpoint",)
+)
+STARTUP_SECONDS = Gauge(
+    "safesafar_startup_seconds", "Seconds from process start to each startup phase completing", ("phase",)
+)
+TRIP_HISTORY_TRIPS = Gauge(
+    "safesafar_trip_history_trips", "Trips currently held in the safety history store"
+)
+TRIP_HISTORY_EVICTIONS = Counter(
+    "safesafar_trip_history_evictions_total", "Trips dropped from the history store to stay within its limit"
+)
+IN_FLIGHT = Gauge(
+    "safesafar_requests_in_flight", "Safety requests currently being processed (admission queue depth)"
+)
+ADMITTED_REQUESTS = Counter(
+    "safesafar_admitted_requests_total", "Safety requests admitted per service mode", ("endpoint", "mode")
+)
+SHED_REQUESTS = Counter(
+    "safesafar_shed_requests_total", "Safety requests rejected with 503 under overload", ("endpoint",)
+)
+UPSTREAM_COOLDOWN = Gauge(
+    "safesafar_upstream_cooldown", "1 from a provider tripping its failure threshold until its next successful call", ("provider",)
+)
@@ -0,0 +1,95 @@
+"""
+Opt-in sampling profiler for slow requests
+Samples stacks of threads working on in-flight requests and writes folded
+stacks (flamegraph.pl / speedscope format) for requests over a threshold
+
+Enable with PROFILE_SLOW_REQUESTS=true; tune with PROFILE_THRESHOLD_MS,
+PROFILE_INTERVAL_MS and PROFILE_DIR.
+"""
+
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+
+_active = set()
+_lock = threading.Lock()
+_sampler = None
+
+
+def _stack_key(frame):
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+def _sample_loop():
+    interval = get_settings().profile_interval_ms / 1000.0
+    while True:
+        time.sleep(interval)
+        with _lock:
+            active = list(_active)
+        if not active:
+            continue
+        frames = sys._current_frames()
+        for timing in active:
+            for ident in list(timing.threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    key = _stack_key(frame)
+                    timing.samples[key] = timing.samples.get(key, 0) + 1
+
+
+def _ensure_sampler():
+    global _sampler
+    if _sampler is None:
+        with _lock:
+            if _sampler is None:
+                _sampler = threading.Thread(target=_sample_loop, name="request-profiler", daemon=True)
+                _sampler.start()
+
+
+def watch(timing):
+    """Start sampling threads attached to ``timing`` (no-op unless enabled)"""
+    if not get_settings().profile_slow_requests:
+        return
+    _ensure_sampler()
+    with _lock:
+        _active.add(timing)
+
+
+def finish(timing):
+    """
+    Stop sampling ``timing``; if the request exceeded the threshold, write its
+    folded stacks to PROFILE_DIR and return the file path.
+    """
+    settings = get_settings()
+    if not settings.profile_slow_requests:
+        return None
+    with _lock:
+        _active.discard(timing)
+    elapsed_ms = timing.elapsed() * 1000
+    samples = dict(timing.samples)
+    if elapsed_ms < settings.profile_threshold_ms or not samples:
+        return None
+    try:
+        os.makedirs(settings.profile_dir, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", timing.name)
+        path = os.path.join(settings.profile_dir, f"{int(time.time() * 1000)}-{name}-{int(elapsed_ms)}ms.folded")
+        with open(path, "w") as f:
+            for stack, count in sorted(samples.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        logger.info("Slow request %s took %.0fms, profile written to %s", timing.name, elapsed_ms, path)
+        return path
+    except Exception as e:
+        logger.warning("Failed to write profile: %s", e)
+        return None
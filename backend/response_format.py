@@ -0,0 +1,100 @@
+"""
+Response shaping and JSON serialization for the safety endpoints
+Uses orjson when installed, otherwise compact stdlib json
+
+Clients can trim payloads with:
+    compact=1          - unsafe_areas holds waypoint indices instead of copies,
+                         and verbose fields (description, air_quality, details)
+                         are dropped unless listed in ``fields``
+    fields=a,b,c       - only include these keys in each location object
+Both can be passed as query parameters or as top-level JSON body keys.
+"""
+
+import json
+
+from flask import Response
+
+import timing
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+VERBOSE_FIELDS = ("description", "air_quality", "details")
+
+
+def dumps(payload):
+    """Serialize a response payload to UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def json_response(payload, status=200, headers=None):
+    """Fast replacement for ``jsonify`` on hot endpoints"""
+    with timing.stage("serialize"):
+        body = dumps(payload)
+    return Response(body, status=status, headers=headers, mimetype="application/json")
+
+
+def _truthy(value):
+    return str(value).lower() in ("1", "true", "yes")
+
+
+class ResponseOptions:
+    """Client-selected response shape"""
+
+    __slots__ = ("compact", "fields")
+
+    def __init__(self, compact=False, fields=None):
+        self.compact = compact
+        self.fields = fields
+
+    @classmethod
+    def from_request(cls, args, body):
+        """Read options from query args / JSON body; ValueError if malformed"""
+        body = body if isinstance(body, dict) else {}
+        compact = _truthy(args.get("compact", body.get("compact", False)))
+        raw_fields = args.get("fields", body.get("fields"))
+        if isinstance(raw_fields, str):
+            raw_fields = [f.strip() for f in raw_fields.split(",") if f.strip()]
+        elif raw_fields is not None and (
+            not isinstance(raw_fields, list) or not all(isinstance(f, str) for f in raw_fields)
+        ):
+            raise ValueError("fields must be a comma-separated string or a list of strings")
+        fields = frozenset(raw_fields) if raw_fields else None
+        return cls(compact, fields)
+
+    @property
+    def is_default(self):
+        return not self.compact and self.fields is None
+
+    def tag(self):
+        """Short string identifying this shape, for response validators"""
+        if self.is_default:
+            return "full"
+        return f"c{int(self.compact)}:{','.join(sorted(self.fields or ()))}"
+
+
+def shape_location(location, options):
+    """Apply ``fields``/``compact`` to one location/waypoint dict"""
+    if options.fields is not None:
+        return {key: value for key, value in location.items() if key in options.fields}
+    if options.compact:
+        return {key: value for key, value in location.items() if key not in VERBOSE_FIELDS}
+    return location
+
+
+def shape_route(result, options):
+    """Apply response options to a ``get_route_weather_safety`` result"""
+    if options.is_default or "waypoints" not in result:
+        return result
+    waypoints = result["waypoints"]
+    shaped = dict(result)
+    shaped["waypoints"] = [shape_location(wp, options) for wp in waypoints]
+    if options.compact:
+        shaped["unsafe_areas"] = [i for i, wp in enumerate(waypoints) if wp["status"] != "SAFE"]
+    else:
+        shaped["unsafe_areas"] = [shape_location(wp, options) for wp in result.get("unsafe_areas", [])]
+    return shaped
@@ -0,0 +1,200 @@
+"""
+Single-pass, constant-memory aggregation of per-waypoint safety results
+Scores are weighted by the route distance each waypoint represents
+"""
+
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+RISK_BINS = 100  # histogram resolution for risk percentiles (risk = 1 - safety)
+_BIN_EPSILON = 1e-9  # keeps e.g. 1 - 0.71 = 0.28999... in the 0.29 bin
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two coordinates in km"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class RouteAggregator:
+    """
+    Streams waypoint results in route order and keeps only running totals.
+
+    Each segment between consecutive waypoints gives half its length to each
+    endpoint, so the weighted average is the trapezoid integral of the score
+    along the route divided by its length. UNKNOWN waypoints (scored without
+    real weather data) are left out of the score averages, percentiles and
+    minimums but never count as safe; with no known waypoint those fields
+    are None. A "risky" waypoint is any non-SAFE one; the worst stretch is
+    the run of consecutive risky waypoints covering the most distance,
+    measured the same way (half of each adjacent segment per waypoint), so
+    run lengths add up to ``unsafe_km``.
+    """
+
+    __slots__ = (
+        "count", "known_count", "unknown_count", "score_sum", "length_km", "known_km",
+        "weighted_sum", "unsafe_count", "unsafe_km",
+        "risk_hist", "risk_counts", "_prev", "_run_start", "_run_km", "_run_points", "_run_min",
+        "worst_start", "worst_end", "worst_km", "worst_points", "worst_min",
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.known_count = 0
+        self.unknown_count = 0
+        self.score_sum = 0.0
+        self.length_km = 0.0
+        self.known_km = 0.0
+        self.weighted_sum = 0.0
+        self.unsafe_count = 0
+        self.unsafe_km = 0.0
+        self.risk_hist = [0.0] * RISK_BINS   # km per risk bin
+        self.risk_counts = [0] * RISK_BINS   # known waypoints per risk bin
+        self._prev = None  # (lat, lon, score, risky, known)
+        self._run_start = None
+        self._run_km = 0.0
+        self._run_points = 0
+        self._run_min = None
+        self.worst_start = None
+        self.worst_end = None
+        self.worst_km = 0.0
+        self.worst_points = 0
+        self.worst_min = None
+
+    def _bin(self, score):
+        risk = min(1.0, max(0.0, 1.0 - score))
+        return min(RISK_BINS - 1, int(risk * RISK_BINS + _BIN_EPSILON))
+
+    def add(self, result):
+        """Add the next waypoint result (dict with lat, lon, safety_score, status)"""
+        index = self.count
+        lat, lon = result["lat"], result["lon"]
+        score = result["safety_score"]
+        risky = result["status"] != "SAFE"
+        known = result["status"] != "UNKNOWN"
+
+        self.count += 1
+        if known:
+            self.known_count += 1
+            self.score_sum += score
+            self.risk_counts[self._bin(score)] += 1
+        else:
+            self.unknown_count += 1
+        if risky:
+            self.unsafe_count += 1
+
+        half = 0.0
+        if self._prev is not None:
+            prev_lat, prev_lon, prev_score, prev_risky, prev_known = self._prev
+            segment = haversine_km(prev_lat, prev_lon, lat, lon)
+            half = segment / 2
+            self.length_km += segment
+            for endpoint_score, endpoint_known in ((prev_score, prev_known), (score, known)):
+                if endpoint_known:
+                    self.known_km += half
+                    self.weighted_sum += endpoint_score * half
+                    self.risk_hist[self._bin(endpoint_score)] += half
+            if prev_risky:
+                self.unsafe_km += half
+                # The run ending at the previous waypoint covers its forward half
+                self._run_km += half
+                self._update_worst(index - 1)
+            if risky:
+                self.unsafe_km += half
+
+        if risky:
+            if self._run_start is None:
+                self._run_start = index
+                self._run_km = 0.0
+                self._run_points = 0
+                self._run_min = None
+            self._run_km += half
+            self._run_points += 1
+            if known and (self._run_min is None or score < self._run_min):
+                self._run_min = score
+            self._update_worst(index)
+        else:
+            self._run_start = None
+
+        self._prev = (lat, lon, score, risky, known)
+
+    def _update_worst(self, index):
+        if (self._run_km, self._run_points) > (self.worst_km, self.worst_points):
+            self.worst_start = self._run_start
+            self.worst_end = index
+            self.worst_km = self._run_km
+            self.worst_points = self._run_points
+            self.worst_min = self._run_min
+
+    @property
+    def mean_safety(self):
+        return self.score_sum / self.known_count if self.known_count else None
+
+    @property
+    def weighted_safety(self):
+        """Distance-weighted average over known waypoints; plain mean if they cover no distance"""
+        if self.known_km > 0:
+            return self.weighted_sum / self.known_km
+        return self.mean_safety
+
+    @property
+    def unsafe_fraction(self):
+        """Share of route distance (or of waypoints, for zero-length routes) that is risky"""
+        if self.length_km > 0:
+            return self.unsafe_km / self.length_km
+        return self.unsafe_count / self.count if self.count else 0.0
+
+    def risk_percentile(self, pct):
+        """
+        Distance-weighted risk (1 - safety) at percentile ``pct``, to the
+        histogram's resolution (lower edge of the bin reached). If known
+        waypoints cover no distance, every known waypoint weighs the same.
+        """
+        hist = self.risk_hist if sum(self.risk_hist) > 0 else self.risk_counts
+        total = sum(hist)
+        if total <= 0:
+            return None
+        target = total * pct / 100.0
+        cumulative = 0.0
+        for i, weight in enumerate(hist):
+            cumulative += weight
+            if cumulative >= target and weight > 0:
+                return round(i / RISK_BINS, 4)
+        return round((RISK_BINS - 1) / RISK_BINS, 4)
+
+    def route_status(self):
+        if self.count and not self.known_count:
+            return "UNKNOWN"
+        if self.unsafe_count == 0:
+            return "SAFE"
+        if self.unsafe_fraction <= 0.5:
+            return "MODERATE"
+        return "RISKY"
+
+    def worst_stretch(self):
+        if self.worst_start is None:
+            return None
+        return {
+            "start_index": self.worst_start,
+            "end_index": self.worst_end,
+            "length_km": round(self.worst_km, 3),
+            "waypoints": self.worst_points,
+            "min_safety": self.worst_min,
+        }
+
+    def summary(self, percentile=90):
+        return {
+            "average_safety": self.weighted_safety,
+            "mean_safety": self.mean_safety,
+            "route_length_km": round(self.length_km, 3),
+            "unsafe_distance_km": round(self.unsafe_km, 3),
+            "unsafe_fraction": round(self.unsafe_fraction, 4),
+            f"risk_p{percentile}": self.risk_percentile(percentile),
+            "worst_stretch": self.worst_stretch(),
+            "route_status": self.route_status(),
+            "unsafe_count": self.unsafe_count,
+            "unknown_count": self.unknown_count,
+        }
@@ -2,29 +2,165 @@
 SafeSafar Weather-based Safety Service
 Uses Open-Meteo API for real weather data to calculate route safety scores
 Runs on port 5002
+
+Startup sequence:
+  1. import: read settings once, build the app (no network, no cache files)
+  2. background warm-up: load cache files into memory, create the HTTP session
+  3. /health answers as soon as the process is up; /ready once warm-up is done
 """
 
-from flask import Flask, request, jsonify
+import time
+
+PROCESS_START = time.perf_counter()
+
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
+import hmac
 import logging
-from weather_safety import get_route_weather_safety, calculate_weather_safety_score
+import threading
+from functools import wraps
+from config import get_settings
+from weather_safety import (
+    get_route_weather_safety, calculate_weather_safety_score, get_safety_data_version, safety_status,
+    WEATHER_CACHE, SCORE_CACHE
+)
+from air_quality import AQI_CACHE
+import admission
+import auth_token
+import cache_admin
+import metrics
+import profiler
+import timing
+import upstream
+from trip_history import TRIP_HISTORY, valid_trip_id
+from response_format import ResponseOptions, json_response, shape_location, shape_route
 
-import os
+settings = get_settings()
 
 app = Flask(__name__)
 
 # Enable CORS for frontend (local and production)
 allowed_origins = [
     "https://safe-safar-deploy.vercel.app",
-    os.getenv("FRONTEND_URL", "https://safe-safar-deploy.vercel.app")
+    settings.frontend_url
 ]
 
-CORS(app, origins=allowed_origins)
+# Endpoints that go through admission control (see admission.py)
+ADMITTED_ENDPOINTS = ("safety_score", "route_safety")
+
+# ETag must be readable by the tracking page to send it back as If-None-Match
+CORS(app, origins=allowed_origins, expose_headers=["ETag", "Server-Timing", "X-Service-Mode"])
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (LOG_LEVEL=DEBUG shows per-request cache hits)
+logging.basicConfig(level=settings.log_level)
 logger = logging.getLogger(__name__)
 
+caches_warm = threading.Event()
+_first_response_seen = False
+
+def warm_up():
+    """Load cache files into memory and open the upstream HTTP session"""
+    start = time.perf_counter()
+    try:
+        WEATHER_CACHE.load_file()
+        AQI_CACHE.load_file()
+        if upstream.mode() != "replay":
+            upstream.get_session()
+    except Exception:
+        logger.exception("Warm-up failed; caches will fill on demand")
+    finally:
+        metrics.STARTUP_SECONDS.set("warm_up", value=time.perf_counter() - start)
+        caches_warm.set()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.timing = timing.begin(request.endpoint or "unknown")
+    profiler.watch(g.timing)
+    if request.endpoint in ADMITTED_ENDPOINTS:
+        g.admission_mode = admission.admit(request.endpoint)
+        if g.admission_mode == admission.SHED:
+            response = jsonify({"error": "Service overloaded, retry shortly"})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(admission.SHED_RETRY_AFTER)
+            return response
+        # Only admitted requests are replayed; shed ones never reached the service
+        if upstream.mode() == "record":
+            upstream.record_traffic(request.path, request.get_json(silent=True))
+
+@app.after_request
+def record_request_latency(response):
+    global _first_response_seen
+    if not _first_response_seen:
+        _first_response_seen = True
+        elapsed = time.perf_counter() - PROCESS_START
+        metrics.STARTUP_SECONDS.set("first_response", value=elapsed)
+        logger.info("First response %.3fs after process start", elapsed)
+    start = g.get("request_start")
+    if start is not None:
+        metrics.REQUEST_LATENCY.observe(
+            request.endpoint or "unknown", request.method, str(response.status_code),
+            value=time.perf_counter() - start
+        )
+    mode = g.get("admission_mode")
+    if mode is not None:
+        response.headers["X-Service-Mode"] = mode
+    request_timing = g.get("timing")
+    if request_timing is not None:
+        response.headers["Server-Timing"] = request_timing.server_timing_header()
+        profiler.finish(request_timing)
+        timing.end()
+    return response
+
+@app.teardown_request
+def release_admission(exc):
+    if g.get("admission_mode") not in (None, admission.SHED):
+        admission.release()
+
+def authenticated_user():
+    """User id from the Node login token in Authorization, or None if missing/invalid or JWT_SECRET is unset"""
+    try:
+        return auth_token.user_id(request.headers.get("Authorization", ""), settings.jwt_secret)
+    except auth_token.TokenError as e:
+        logger.debug("Rejected token: %s", e)
+        return None
+
+def require_user(view):
+    """Allow the request only with a valid login token; the user id goes to g.user_id"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not settings.jwt_secret:
+            return jsonify({"error": "trip history disabled (JWT_SECRET not set)"}), 404
+        g.user_id = authenticated_user()
+        if g.user_id is None:
+            return jsonify({"error": "unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def record_trip_point(user_id, trip_id, lat, lon, score):
+    """Best-effort history append from /safety_score; bad points are skipped"""
+    try:
+        TRIP_HISTORY.record(user_id, trip_id, lat, lon, score)
+    except ValueError as e:
+        logger.debug("Skipped trip history point for %s: %s", trip_id, e)
+
+def safety_etag(version, options):
+    """Weak ETag for a /safety_score response from its input version, or None without one"""
+    if version is None or debug_requested():
+        return None
+    return f"{version}-{options.tag()}"
+
+def debug_requested():
+    """True when the client asked for the per-stage timing breakdown (?debug=1)"""
+    return request.args.get("debug", "").lower() in ("1", "true", "timing")
+
+def with_debug_timing(payload):
+    """Attach the current request's stage timings to a response dict if requested"""
+    request_timing = timing.current()
+    if request_timing is not None and debug_requested():
+        payload["timing"] = request_timing.as_dict()
+    return payload
+
 @app.route("/safety_score", methods=["POST"])
 def safety_score():
     """
@@ -41,13 +177,23 @@ def safety_score():
       "lat": 28.7,
       "lon": 77.1,
       "safety_score": 0.75,
-      "status": "SAFE",
+      "status": "SAFE",               (UNKNOWN when no weather data was available)
+      "data_source": "live",          (live | partial: no air quality | fallback)
       "weather_type": "clear",
       "temperature": 25,
       "wind_speed": 10,
       "precipitation": 0,
       "humidity": 60
     }
+    
+    Live responses carry a weak ETag derived from the weather/AQI inputs
+    they were scored from; send it back as If-None-Match to get an empty 304
+    while the cached inputs are unchanged.
+    
+    With an optional "trip_id" each check (including 304s) is appended to
+    that trip's history, see /trips/<trip_id>/history, if JWT_SECRET is set
+    and the user's login token in Authorization verifies; otherwise the
+    check is scored as usual and not recorded.
     """
     try:
         data = request.get_json(force=True)
@@ -63,6 +209,30 @@ def safety_score():
         except ValueError:
             return jsonify({"error": "lat and lon must be numeric"}), 400
         
+        trip_id = data.get("trip_id")
+        if trip_id is not None and not valid_trip_id(trip_id):
+            return jsonify({"error": "invalid trip_id"}), 400
+        # History is optional: without JWT_SECRET or a valid token the check
+        # is still scored, it just isn't recorded
+        history_user = authenticated_user() if trip_id is not None else None
+        
+        try:
+            options = ResponseOptions.from_request(request.args, data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # Repeated polls of an unchanged cache cell skip scoring entirely
+        etag = safety_etag(get_safety_data_version(lat, lon), options)
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            metrics.NOT_MODIFIED.inc("safety_score")
+            if history_user is not None:
+                last_score = TRIP_HISTORY.last_score(history_user, trip_id)
+                if last_score is not None:
+                    record_trip_point(history_user, trip_id, lat, lon, last_score)
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+        
         # Get weather-based safety score with timeout
         try:
             safety_info = calculate_weather_safety_score(lat, lon)
@@ -73,7 +243,8 @@ def safety_score():
                 "lat": lat,
                 "lon": lon,
                 "safety_score": 0.5,
-                "status": "MODERATE",
+                "status": "UNKNOWN",
+                "data_source": "fallback",
                 "weather_type": "unknown",
                 "temperature": 0,
                 "wind_speed": 0,
@@ -84,25 +255,30 @@ def safety_score():
         
         # Determine status
         safety_score = safety_info.get("safety_score", 0.5)
-        if safety_score >= 0.7:
-            status = "SAFE"
-        elif safety_score >= 0.4:
-            status = "MODERATE"
-        else:
-            status = "RISKY"
+        status = safety_status(safety_info)
         
-        return jsonify({
+        if history_user is not None and status != "UNKNOWN":
+            record_trip_point(history_user, trip_id, lat, lon, safety_score)
+        
+        response = json_response(with_debug_timing(shape_location({
             "lat": lat,
             "lon": lon,
             "safety_score": safety_score,
             "status": status,
+            "data_source": safety_info.get("data_source", "live"),
             "description": safety_info.get("description", ""),
             "weather_type": safety_info.get("weather_type", "unknown"),
             "temperature": safety_info.get("temperature", 0),
             "wind_speed": safety_info.get("wind_speed", 0),
             "precipitation": safety_info.get("precipitation", 0),
             "humidity": safety_info.get("humidity", 0)
-        })
+        }, options)))
+        # Tag the records this score was computed from, not whatever is cached
+        # now; partial and fallback results get no ETag
+        etag = safety_etag(safety_info.get("data_version"), options)
+        if etag is not None:
+            response.set_etag(etag, weak=True)
+        return response
     
     except Exception as e:
         logger.exception("Safety score calculation error")
@@ -129,6 +305,9 @@ def route_safety():
       "route_status": "SAFE",
       "unsafe_count": 0
     }
+    
+    Optional "compact": true / "fields": [...] (body or query) trim the
+    payload; in compact mode unsafe_areas holds waypoint indices.
     """
     try:
         data = request.get_json(force=True)
@@ -137,15 +316,134 @@ def route_safety():
         if not waypoints:
             return jsonify({"error": "waypoints array is required"}), 400
         
+        try:
+            options = ResponseOptions.from_request(request.args, data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
         # Get route safety from weather analysis
         safety_result = get_route_weather_safety(waypoints)
         
-        return jsonify(safety_result)
+        return json_response(with_debug_timing(shape_route(safety_result, options)))
     
     except Exception as e:
         logger.exception("Route safety check error")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/trips/<trip_id>/history", methods=["POST"])
+@require_user
+def record_trip_history(trip_id):
+    """
+    Append a safety check to the caller's history for a trip.
+    Needs the login token issued by the Node backend in Authorization.
+    
+    Request JSON:
+    {
+      "lat": 28.7,
+      "lon": 77.1,
+      "score": 0.75,
+      "ts": 1760000000.0      (optional, seconds since epoch within the last
+                               7 days; defaults to now)
+    }
+    
+    Points older than the trip's last point are rejected with 409.
+    """
+    if not valid_trip_id(trip_id):
+        return jsonify({"error": "invalid trip_id"}), 400
+    data = request.get_json(silent=True) or {}
+    try:
+        lat = float(data["lat"])
+        lon = float(data["lon"])
+        score = float(data["score"])
+        ts = float(data["ts"]) if data.get("ts") is not None else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "lat, lon and score are required and must be numeric"}), 400
+    try:
+        stored = TRIP_HISTORY.record(g.user_id, trip_id, lat, lon, score, ts)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not stored:
+        return jsonify({"error": "ts is older than the trip's last point"}), 409
+    return jsonify({"status": "recorded"}), 201
+
+@app.route("/trips/<trip_id>/history", methods=["GET"])
+@require_user
+def trip_history(trip_id):
+    """
+    The caller's safety history for a trip, oldest first.
+    Needs the login token issued by the Node backend in Authorization.
+    
+    Query parameters (all optional):
+      start, end   - time range in seconds since epoch (inclusive)
+      max_points   - downsample to at most this many points (default 200);
+                     downsampled points carry min_score and samples
+    
+    Response JSON:
+    {
+      "trip_id": "...",
+      "points": [{"ts": 1760000000.0, "lat": 28.7, "lon": 77.1, "score": 0.75}, ...]
+    }
+    """
+    if not valid_trip_id(trip_id):
+        return jsonify({"error": "invalid trip_id"}), 400
+    try:
+        start = request.args.get("start", type=float)
+        end = request.args.get("end", type=float)
+        max_points = max(1, int(request.args.get("max_points", 200)))
+    except ValueError:
+        return jsonify({"error": "max_points must be an integer"}), 400
+    points = TRIP_HISTORY.query(g.user_id, trip_id, start, end, max_points)
+    if points is None:
+        return jsonify({"error": "no history for this trip"}), 404
+    return json_response({"trip_id": trip_id, "points": points})
+
+CACHES = {"weather": WEATHER_CACHE, "aqi": AQI_CACHE, "scores": SCORE_CACHE}
+
+def require_admin(view):
+    """Allow the request only with the ADMIN_TOKEN (Bearer or X-Admin-Token); 404 if unset"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not settings.admin_token:
+            return jsonify({"error": "admin API disabled"}), 404
+        supplied = request.headers.get("X-Admin-Token", "")
+        auth = request.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            supplied = auth[len("Bearer "):]
+        if not hmac.compare_digest(supplied.encode(), settings.admin_token.encode()):
+            return jsonify({"error": "unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route("/admin/caches", methods=["GET"])
+@require_admin
+def admin_caches():
+    """Size, memory use, entry ages and per-layer hit rates of each cache"""
+    return jsonify({name: cache_admin.cache_stats(cache) for name, cache in CACHES.items()})
+
+@app.route("/admin/caches/<name>/invalidate", methods=["POST"])
+@require_admin
+def admin_invalidate_cache(name):
+    """
+    Drop matching entries from one cache ("weather", "aqi", "scores") or "all".
+    
+    Request JSON (filters are combined; see cache_admin.py):
+    {"bbox": [28.4, 76.8, 28.9, 77.4]} | {"prefix": "28.6"} | {"older_than_s": 1800} | {"all": true}
+    
+    Invalidating "scores" forces recomputation and changes every ETag; it
+    is not enough after a scoring rule change, which needs SCORING_VERSION
+    bumped (see weather_safety.py).
+    """
+    if name != "all" and name not in CACHES:
+        return jsonify({"error": f"unknown cache {name!r}"}), 404
+    try:
+        predicate = cache_admin.build_predicate(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    targets = CACHES if name == "all" else {name: CACHES[name]}
+    removed = {target: cache.invalidate(predicate) for target, cache in targets.items()}
+    logger.info("Invalidated cache entries: %s", removed)
+    return jsonify({"removed": removed})
+
 @app.route("/health", methods=["GET"])
 def health():
     """Health check endpoint"""
@@ -155,5 +453,25 @@ def health():
         "data_source": "Open-Meteo API"
     })
 
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness endpoint: 200 once caches are warm, 503 while warming up"""
+    if not caches_warm.is_set():
+        return jsonify({"status": "warming"}), 503
+    return jsonify({
+        "status": "ready",
+        "cache_entries": {"weather": len(WEATHER_CACHE.memory), "aqi": len(AQI_CACHE.memory)},
+        "in_flight": admission.in_flight(),
+        "mode": admission.choose_mode(admission.in_flight())
+    })
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus-style metrics endpoint"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+metrics.STARTUP_SECONDS.set("import", value=time.perf_counter() - PROCESS_START)
+threading.Thread(target=warm_up, name="cache-warmup", daemon=True).start()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5002, debug=True)
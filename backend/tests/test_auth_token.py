@@ -0,0 +1,113 @@
+"""Tests for the stdlib HS256 verifier in auth_token.py"""
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+
+from auth_token import TokenError, user_id, verify_token
+
+SECRET = "test-secret"
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def make_token(claims, secret=SECRET, header=None):
+    header = {"alg": "HS256", "typ": "JWT"} if header is None else header
+    signing_input = f"{b64(json.dumps(header).encode())}.{b64(json.dumps(claims).encode())}"
+    signature = hmac.new(secret.encode(), signing_input.encode(), hashlib.sha256).digest()
+    return f"{signing_input}.{b64(signature)}"
+
+
+def test_valid_token():
+    token = make_token({"id": "u1", "exp": time.time() + 60})
+    assert verify_token(token, SECRET)["id"] == "u1"
+    assert user_id(token, SECRET) == "u1"
+    assert user_id("Bearer " + token, SECRET) == "u1"
+
+
+def test_missing_token_or_secret():
+    token = make_token({"id": "u1"})
+    with pytest.raises(TokenError):
+        verify_token("", SECRET)
+    with pytest.raises(TokenError):
+        verify_token(token, "")
+
+
+def test_bad_signature():
+    token = make_token({"id": "u1"})
+    with pytest.raises(TokenError, match="bad signature"):
+        verify_token(token, "other-secret")
+    header, payload, signature = token.split(".")
+    forged = b64(json.dumps({"id": "admin"}).encode())
+    with pytest.raises(TokenError, match="bad signature"):
+        verify_token(f"{header}.{forged}.{signature}", SECRET)
+    with pytest.raises(TokenError):
+        verify_token(f"{header}.{payload}.", SECRET)
+
+
+@pytest.mark.parametrize("alg", ["none", "HS512", "RS256", None])
+def test_other_algorithms_rejected(alg):
+    header = {"typ": "JWT"} if alg is None else {"alg": alg, "typ": "JWT"}
+    token = make_token({"id": "u1"}, header=header)
+    with pytest.raises(TokenError, match="unsupported"):
+        verify_token(token, SECRET)
+
+
+def test_unsigned_token_rejected():
+    token = make_token({"id": "u1"}, header={"alg": "none"})
+    header, payload, _ = token.split(".")
+    with pytest.raises(TokenError):
+        verify_token(f"{header}.{payload}.", SECRET)
+
+
+def test_expiry():
+    with pytest.raises(TokenError, match="expired"):
+        verify_token(make_token({"id": "u1", "exp": time.time() - 1}), SECRET)
+    # Non-numeric expiries are treated as expired, not as "never"
+    for exp in ("9999999999", True):
+        with pytest.raises(TokenError, match="expired"):
+            verify_token(make_token({"id": "u1", "exp": exp}), SECRET)
+    # No exp claim at all: the Node backend always sets one, but it is optional
+    assert verify_token(make_token({"id": "u1"}), SECRET)["id"] == "u1"
+
+
+@pytest.mark.parametrize("uid", ["u", "ab", "abc", "abcd", "64f0c2a1e4b0a1b2c3d4e5f6"])
+def test_unpadded_segments_of_any_length(uid):
+    # Payload lengths vary mod 4, so the segments need 0-2 padding chars restored
+    assert user_id(make_token({"id": uid}), SECRET) == uid
+
+
+def test_padded_or_non_url_safe_segments_rejected():
+    token = make_token({"id": "u"})
+    header, payload, signature = token.split(".")
+    assert len(payload) % 4, "payload should need padding for this test"
+    padded = payload + "=" * (-len(payload) % 4)
+    with pytest.raises(TokenError, match="malformed"):
+        verify_token(f"{header}.{padded}.{signature}", SECRET)
+    with pytest.raises(TokenError, match="malformed"):
+        verify_token(f"{header}.{payload}.{signature}==", SECRET)
+    standard = signature.replace("-", "+").replace("_", "/")
+    if standard != signature:
+        with pytest.raises(TokenError, match="malformed"):
+            verify_token(f"{header}.{payload}.{standard}", SECRET)
+    # Stray characters must not be silently dropped by the decoder
+    with pytest.raises(TokenError, match="malformed"):
+        verify_token(f"{header}.{payload}.{signature}!", SECRET)
+
+
+@pytest.mark.parametrize("token", ["abc", "a.b", "a.b.c.d", "a.b.c", "x.y.", "e30.e30.a"])
+def test_malformed_tokens(token):
+    with pytest.raises(TokenError):
+        verify_token(token, SECRET)
+
+
+def test_user_id_requires_id_claim():
+    for claims in ({}, {"id": ""}, {"id": 42}):
+        with pytest.raises(TokenError, match="no user id"):
+            user_id(make_token(claims), SECRET)
@@ -0,0 +1,97 @@
+"""
+Per-request stage timing (cache I/O, upstream fetches, retries, scoring)
+Exposed to clients as a Server-Timing header and an optional debug field
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    """Accumulated stage durations for one request, shared with its worker threads"""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.threads = {threading.get_ident()}
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def as_dict(self):
+        """Stage durations in milliseconds, plus wall-clock total"""
+        with self._lock:
+            result = {stage: round(seconds * 1000, 2) for stage, seconds in self.stages.items()}
+        result["total"] = round(self.elapsed() * 1000, 2)
+        return result
+
+    def server_timing_header(self):
+        return ", ".join(f"{stage};dur={ms}" for stage, ms in self.as_dict().items())
+
+
+def begin(name):
+    """Start timing the current request"""
+    timing = RequestTiming(name)
+    _current.set(timing)
+    return timing
+
+
+def current():
+    return _current.get()
+
+
+def end():
+    _current.set(None)
+
+
+def add(stage, seconds):
+    """Add ``seconds`` to ``stage`` for the current request, if any"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(stage, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as ``name`` for the current request"""
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - start)
+
+
+def bind(fn):
+    """
+    Wrap ``fn`` to run in a copy of the caller's context, e.g. on an executor
+    thread, so its stages are attributed to the calling request.
+    """
+    ctx = contextvars.copy_context()
+    timing = _current.get()
+
+    def run(*args, **kwargs):
+        if timing is None:
+            return ctx.run(fn, *args, **kwargs)
+        ident = threading.get_ident()
+        timing.threads.add(ident)
+        try:
+            return ctx.run(fn, *args, **kwargs)
+        finally:
+            timing.threads.discard(ident)
+
+    return run
@@ -0,0 +1,198 @@
+"""
+Per-trip safety history kept in memory as fixed-size ring buffers
+Each trip stores (timestamp, lat, lon, score) in parallel typed arrays, so a
+trip costs a fixed ~20 bytes per slot however long it runs. The number of
+trips is capped too: the least recently updated trip is dropped first, and
+one user can hold at most TRIP_HISTORY_TRIPS_PER_USER trips.
+
+Trips are keyed by (user id, trip id), so a user only ever sees their own
+history. Points must arrive in time order (out-of-order points are rejected),
+which lets range queries binary-search the ring instead of scanning it.
+"""
+
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+import metrics
+from config import get_settings
+
+MAX_TRIP_ID_LENGTH = 64
+MAX_CLOCK_SKEW_S = 300            # accepted future timestamps
+MAX_POINT_AGE_S = 7 * 24 * 3600   # accepted past timestamps
+
+
+def valid_trip_id(trip_id):
+    """Trip ids are short opaque tokens (e.g. Mongo ObjectIds)"""
+    return (
+        isinstance(trip_id, str)
+        and 0 < len(trip_id) <= MAX_TRIP_ID_LENGTH
+        and all(c.isalnum() or c in "-_" for c in trip_id)
+    )
+
+
+def validate_point(ts, lat, lon, score):
+    """Raise ValueError unless the point is finite and in range"""
+    for name, value in (("ts", ts), ("lat", lat), ("lon", lon), ("score", score)):
+        if not math.isfinite(value):
+            raise ValueError(f"{name} must be finite")
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise ValueError("lat/lon out of range")
+    if not 0 <= score <= 1:
+        raise ValueError("score must be between 0 and 1")
+    now = time.time()
+    if not now - MAX_POINT_AGE_S <= ts <= now + MAX_CLOCK_SKEW_S:
+        raise ValueError("ts must be epoch seconds within the last 7 days")
+
+
+class TripSeries:
+    """Ring buffer of one trip's safety checks, oldest first"""
+
+    __slots__ = ("capacity", "ts", "lat", "lon", "score", "start", "size")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # Coordinates and scores as float32 (~1 m precision); timestamps need float64
+        self.ts = array("d", bytes(8 * capacity))
+        self.lat = array("f", bytes(4 * capacity))
+        self.lon = array("f", bytes(4 * capacity))
+        self.score = array("f", bytes(4 * capacity))
+        self.start = 0
+        self.size = 0
+
+    def _slot(self, i):
+        return (self.start + i) % self.capacity
+
+    def append(self, ts, lat, lon, score):
+        """Add a point; returns False (and stores nothing) if it is older than the last one"""
+        if self.size and ts < self.ts[self._slot(self.size - 1)]:
+            return False
+        if self.size < self.capacity:
+            slot = self._slot(self.size)
+            self.size += 1
+        else:
+            # Full: overwrite the oldest point
+            slot = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.ts[slot] = ts
+        self.lat[slot] = lat
+        self.lon[slot] = lon
+        self.score[slot] = score
+        return True
+
+    def last_score(self):
+        if not self.size:
+            return None
+        return self.score[self._slot(self.size - 1)]
+
+    def _bisect(self, ts, right=False):
+        """First logical index with timestamp >= ts (> ts if ``right``)"""
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self.ts[self._slot(mid)]
+            if value < ts or (right and value == ts):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, start=None, end=None, max_points=None):
+        """
+        Points with start <= ts <= end, downsampled to at most ``max_points``.
+
+        Downsampling splits the range into equal runs of points; each run
+        reports its mean score, its minimum score and its last position.
+        """
+        first = 0 if start is None else self._bisect(start)
+        last = self.size if end is None else self._bisect(end, right=True)
+        count = max(0, last - first)
+        if not count:
+            return []
+        step = 1 if not max_points or count <= max_points else -(-count // max_points)
+
+        points = []
+        for bucket_start in range(first, last, step):
+            bucket_end = min(bucket_start + step, last)
+            total = 0.0
+            lowest = None
+            for i in range(bucket_start, bucket_end):
+                value = self.score[self._slot(i)]
+                total += value
+                lowest = value if lowest is None or value < lowest else lowest
+            slot = self._slot(bucket_end - 1)
+            point = {
+                "ts": self.ts[slot],
+                "lat": round(self.lat[slot], 6),
+                "lon": round(self.lon[slot], 6),
+                "score": round(total / (bucket_end - bucket_start), 4),
+            }
+            if step > 1:
+                point["min_score"] = round(lowest, 4)
+                point["samples"] = bucket_end - bucket_start
+            points.append(point)
+        return points
+
+
+class TripHistoryStore:
+    """Bounded set of TripSeries keyed by (user_id, trip_id), evicting the least recently updated"""
+
+    def __init__(self, max_trips, points_per_trip, trips_per_user):
+        self.max_trips = max_trips
+        self.points_per_trip = points_per_trip
+        self.trips_per_user = trips_per_user
+        self.trips = OrderedDict()
+        self.user_trips = {}  # user_id -> number of trips held
+        self._lock = threading.Lock()
+
+    def _evict(self, key):
+        del self.trips[key]
+        user = key[0]
+        self.user_trips[user] -= 1
+        if not self.user_trips[user]:
+            del self.user_trips[user]
+        metrics.TRIP_HISTORY_EVICTIONS.inc()
+
+    def record(self, user_id, trip_id, lat, lon, score, ts=None):
+        """
+        Append a point (validated; ValueError if not). Returns False if it
+        was dropped for being older than the trip's last point.
+        """
+        ts = time.time() if ts is None else ts
+        validate_point(ts, lat, lon, score)
+        key = (user_id, trip_id)
+        with self._lock:
+            series = self.trips.get(key)
+            if series is None:
+                if self.user_trips.get(user_id, 0) >= self.trips_per_user:
+                    # Replace this user's least recently updated trip, not someone else's
+                    self._evict(next(k for k in self.trips if k[0] == user_id))
+                series = self.trips[key] = TripSeries(self.points_per_trip)
+                self.user_trips[user_id] = self.user_trips.get(user_id, 0) + 1
+                while len(self.trips) > self.max_trips:
+                    self._evict(next(iter(self.trips)))
+                metrics.TRIP_HISTORY_TRIPS.set(value=len(self.trips))
+            else:
+                self.trips.move_to_end(key)
+            return series.append(ts, lat, lon, score)
+
+    def last_score(self, user_id, trip_id):
+        with self._lock:
+            series = self.trips.get((user_id, trip_id))
+            return series.last_score() if series is not None else None
+
+    def query(self, user_id, trip_id, start=None, end=None, max_points=None):
+        """Downsampled points for a trip, or None if the trip is unknown"""
+        with self._lock:
+            series = self.trips.get((user_id, trip_id))
+            if series is None:
+                return None
+            return series.query(start, end, max_points)
+
+
+_settings = get_settings()
+TRIP_HISTORY = TripHistoryStore(
+    _settings.trip_history_max_trips, _settings.trip_history_points, _settings.trip_history_trips_per_user
+)
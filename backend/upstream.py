@@ -0,0 +1,257 @@
+"""
+Shared HTTP client for upstream data providers (Open-Meteo, WAQI)
+Records per-provider latency and rate-limit metrics around each call
+
+``requests`` and its connection pool are created on first use, so importing
+this module is cheap. UPSTREAM_MODE selects how calls are served:
+    live    - call the real API (default)
+    record  - call the real API and append responses (and inbound request
+              bodies) to the archive at UPSTREAM_ARCHIVE
+    replay  - serve responses from the archive only, never touching the network
+
+The archive is two files: ``<path>.dat`` holds zlib-compressed response bodies
+back to back, ``<path>.idx`` holds one JSON line per body with its provider,
+cache key, status, offset and length. Traffic is kept in ``<path>.traffic.jsonl``.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+import admission
+from config import get_settings
+from metrics import UPSTREAM_LATENCY, UPSTREAM_RATE_LIMITED
+import timing
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamError(Exception):
+    """Upstream call failed (bad status, network error)"""
+
+
+class UpstreamTimeout(UpstreamError):
+    """Upstream call timed out"""
+
+
+class UpstreamConnectionError(UpstreamError):
+    """Upstream host could not be reached"""
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared ``requests`` session, imported and created on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                # Route checks fan out to several worker threads per request
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def mode():
+    """Current upstream mode: live, record or replay"""
+    return get_settings().upstream_mode
+
+
+class ArchivedResponse:
+    """Minimal stand-in for ``requests.Response`` served from the archive"""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.content = body
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise UpstreamError(f"{self.status_code} from upstream archive")
+
+
+class UpstreamArchive:
+    """Append-only, indexed store of upstream responses keyed by (provider, key)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.data_path = f"{path}.dat"
+        self.index_path = f"{path}.idx"
+        self.traffic_path = f"{path}.traffic.jsonl"
+        self.index = {}
+        self._cursors = {}
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def load_index(self):
+        """Read the index into memory: {(provider, key): [(offset, length, status), ...]}"""
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.index.setdefault((entry["provider"], entry["key"]), []).append(
+                        (entry["offset"], entry["length"], entry["status"])
+                    )
+        self._cursors = {}
+        return self.index
+
+    def append(self, provider, key, status, body):
+        compressed = zlib.compress(body)
+        with self._lock:
+            with open(self.data_path, "ab") as data:
+                offset = data.tell()
+                data.write(compressed)
+            with open(self.index_path, "a") as index:
+                index.write(json.dumps({
+                    "provider": provider, "key": key, "status": status,
+                    "offset": offset, "length": len(compressed), "ts": time.time()
+                }) + "\n")
+            self.index.setdefault((provider, key), []).append((offset, len(compressed), status))
+
+    def lookup(self, provider, key):
+        """
+        Next recorded (status, body) for (provider, key), or None.
+
+        Repeated lookups step through recordings in order and then keep
+        returning the last one. Each recording is served once per refetch, so
+        the replay only sees data change as it did if caches expire on the
+        recorded timeline (bench/replay_compare.py sets the cache clock from
+        traffic timestamps).
+        """
+        with self._lock:
+            entries = self.index.get((provider, key))
+            if not entries:
+                return None
+            cursor = self._cursors.get((provider, key), 0)
+            self._cursors[(provider, key)] = cursor + 1
+            offset, length, status = entries[min(cursor, len(entries) - 1)]
+            if self._reader is None:
+                self._reader = open(self.data_path, "rb")
+            self._reader.seek(offset)
+            compressed = self._reader.read(length)
+        return status, zlib.decompress(compressed)
+
+    def record_traffic(self, endpoint, body):
+        line = json.dumps({"ts": time.time(), "endpoint": endpoint, "body": body}, separators=(",", ":"))
+        with self._lock:
+            with open(self.traffic_path, "a") as f:
+                f.write(line + "\n")
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """Archive for record/replay modes, opened on first use"""
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                archive = UpstreamArchive(get_settings().upstream_archive)
+                archive.load_index()
+                _archive = archive
+    return _archive
+
+
+# Request fields left out of the traffic log: trip ids are per-user history
+# writes that only work with the caller's Authorization token, which is not
+# recorded, and scoring does not depend on them
+UNRECORDED_FIELDS = ("trip_id",)
+
+
+def replayable_body(body):
+    """Request body without the fields that must not be recorded or replayed"""
+    if not isinstance(body, dict):
+        return body
+    return {k: v for k, v in body.items() if k not in UNRECORDED_FIELDS}
+
+
+def record_traffic(endpoint, body):
+    """Append an inbound request body (see ``replayable_body``) to the traffic log when recording"""
+    if mode() == "record":
+        body = replayable_body(body)
+        try:
+            get_archive().record_traffic(endpoint, body)
+        except Exception as e:
+            logger.warning("Failed to record traffic: %s", e)
+
+
+def _http_get(url, params, timeout):
+    """GET via the shared session, mapping ``requests`` errors to Upstream* errors"""
+    session = get_session()
+    import requests
+
+    try:
+        return session.get(url, params=params, timeout=timeout)
+    except requests.Timeout as e:
+        raise UpstreamTimeout(str(e)) from e
+    except requests.ConnectionError as e:
+        raise UpstreamConnectionError(str(e)) from e
+
+
+def _retry_after(response):
+    """Retry-After header in seconds, or None if absent or not a number"""
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch(provider, url, params=None, timeout=8, key=None):
+    """
+    GET an upstream URL and record its latency under ``provider``.
+
+    ``key`` identifies the request in the record/replay archive (the cache
+    cell); it keeps tokens and exact coordinates out of the archive.
+
+    Returns the response; timeouts and connection failures are raised as
+    UpstreamTimeout / UpstreamConnectionError.
+    """
+    start = time.perf_counter()
+    status = "error"
+    current_mode = mode()
+    try:
+        if current_mode == "replay":
+            recorded = get_archive().lookup(provider, key)
+            response = ArchivedResponse(*recorded) if recorded else ArchivedResponse(404, b"{}")
+        else:
+            response = _http_get(url, params, timeout)
+            # 429s are not archived; the retry that follows is
+            if current_mode == "record" and response.status_code != 429:
+                try:
+                    get_archive().append(provider, key, response.status_code, response.content)
+                except Exception as e:
+                    logger.warning("Failed to archive %s response: %s", provider, e)
+        status = str(response.status_code)
+        if response.status_code == 429:
+            UPSTREAM_RATE_LIMITED.inc(provider)
+        failed = response.status_code == 429 or response.status_code >= 500
+        admission.record_upstream(provider, not failed, _retry_after(response) if failed else None)
+        return response
+    except UpstreamTimeout:
+        status = "timeout"
+        admission.record_upstream(provider, False)
+        raise
+    except UpstreamConnectionError:
+        admission.record_upstream(provider, False)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        UPSTREAM_LATENCY.observe(provider, status, value=elapsed)
+        timing.add(provider, elapsed)
@@ -3,148 +3,166 @@ Weather-based Safety Score Calculator with Air Quality Integration
 Uses Open-Meteo API for weather data and OpenAQ API for air quality
 """
 
-import requests
-from datetime import datetime, timedelta
-from air_quality import get_location_air_quality_score
-import json
-import os
+from air_quality import (
+    get_air_quality_data, get_location_air_quality_score, get_aqi_data_version, aqi_data_version, aqi_input_version
+)
+from cache_store import RecordCache, ScoreCache, cache_key, cache_time
+from config import get_settings
+from metrics import FALLBACKS_SERVED, UPSTREAM_RETRIES
+import admission
+import upstream
+import timing
+import hashlib
+import logging
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from route_aggregate import RouteAggregator
 
-OPEN_METEO_BASE = "https://api.open-meteo.com/v1/forecast"
+logger = logging.getLogger(__name__)
+
+PROVIDER = "open_meteo"
+
+# Bump whenever scoring rules change: it is part of SCORE_CACHE tags and of
+# clients' ETags, and a restart alone changes neither (cache files reload
+# with the same timestamps)
+SCORING_VERSION = "1"
 
-# Use in-memory cache with fallback to file cache
-MEMORY_CACHE = {}
 CACHE_TTL = 3600  # 1 hour (increased from 10 minutes)
 CACHE_FILE = "weather_cache.json"  # Use relative path instead of /tmp/
 
-def load_weather_cache():
-    """Load cache from file"""
-    try:
-        if os.path.exists(CACHE_FILE):
-            with open(CACHE_FILE, 'r') as f:
-                data = json.load(f)
-                MEMORY_CACHE.update(data)
-                return data
-    except Exception as e:
-        print(f"Error loading cache: {e}")
-    return {}
 
-def save_weather_cache(cache):
-    """Save cache to file"""
-    try:
-        with open(CACHE_FILE, 'w') as f:
-            json.dump(cache, f)
-    except Exception as e:
-        print(f"Error saving cache: {e}")
+class WeatherRecord:
+    """
+    Current conditions read by the scorer, plus fetch time (epoch seconds).
+    ``fallback`` marks built-in defaults served without real data; those are
+    never cached.
+    """
 
-def get_cached_weather_data(lat, lon):
-    """Get weather data from cache if available and not expired"""
-    cache_key = f"{round(lat, 2)},{round(lon, 2)}"
-    
-    # Try memory cache first (faster)
-    if cache_key in MEMORY_CACHE:
-        cache_entry = MEMORY_CACHE[cache_key]
-        if isinstance(cache_entry, dict):
-            data = cache_entry.get('data')
-            timestamp = cache_entry.get('timestamp')
-            age = datetime.now() - datetime.fromisoformat(timestamp)
-            if age < timedelta(seconds=CACHE_TTL):
-                print(f"Using cached weather data for ({lat}, {lon}) - age: {age.seconds}s")
-                return data
-    
-    # Try file cache if memory cache miss
-    try:
-        cache = load_weather_cache()
-        if cache_key in cache:
-            cache_entry = cache[cache_key]
-            if isinstance(cache_entry, dict):
-                data = cache_entry.get('data')
-                timestamp = cache_entry.get('timestamp')
-                age = datetime.now() - datetime.fromisoformat(timestamp)
-                # Allow returning file cache even if slightly expired (up to 2x TTL)
-                if age < timedelta(seconds=CACHE_TTL * 2):
-                    print(f"Using file cached weather data for ({lat}, {lon}) - age: {age.seconds}s")
-                    return data
-    except Exception as e:
-        print(f"Error checking file cache: {e}")
-    
-    return None
+    __slots__ = ("temperature", "humidity", "precipitation", "wind_speed", "weather_code", "ts", "fallback")
 
-def cache_weather_data(lat, lon, data):
-    """Cache weather data in memory and file"""
-    cache_key = f"{round(lat, 2)},{round(lon, 2)}"
-    timestamp = datetime.now().isoformat()
-    
-    # Save to memory cache
-    MEMORY_CACHE[cache_key] = {'data': data, 'timestamp': timestamp}
-    
-    # Save to file cache
-    try:
-        cache = load_weather_cache()
-        cache[cache_key] = {'data': data, 'timestamp': timestamp}
-        save_weather_cache(cache)
-    except Exception as e:
-        print(f"Error caching weather data: {e}")
+    def __init__(self, temperature, humidity, precipitation, wind_speed, weather_code, ts, fallback=False):
+        self.temperature = temperature
+        self.humidity = humidity
+        self.precipitation = precipitation
+        self.wind_speed = wind_speed
+        self.weather_code = weather_code
+        self.ts = ts
+        self.fallback = fallback
+
+    @classmethod
+    def from_payload(cls, data):
+        """Normalize an Open-Meteo forecast response; ValueError if it has no current conditions"""
+        current = data.get("current") if isinstance(data, dict) else None
+        if not isinstance(current, dict):
+            raise ValueError("no current conditions in weather response")
+        return cls(
+            current.get("temperature_2m", 20),
+            current.get("relative_humidity_2m", 50),
+            current.get("precipitation", 0),
+            current.get("wind_speed_10m", 0),
+            current.get("weather_code", 0),
+            cache_time()
+        )
+
+    @classmethod
+    def from_row(cls, row):
+        ts, temperature, humidity, precipitation, wind_speed, weather_code = row
+        return cls(temperature, humidity, precipitation, wind_speed, weather_code, ts)
+
+    def to_row(self):
+        return [self.ts, self.temperature, self.humidity, self.precipitation, self.wind_speed, self.weather_code]
+
+
+# In-memory cache with fallback to file cache
+WEATHER_CACHE = RecordCache("weather", CACHE_FILE, WeatherRecord, CACHE_TTL)
+
+# Numeric score components per cell, tagged with the scoring rules and input data they used
+SCORE_CACHE = ScoreCache("scores", get_settings().score_cache_max_entries)
+
+def cache_weather_data(lat, lon, record):
+    """Cache weather record in memory and file"""
+    WEATHER_CACHE.put(lat, lon, record)
+
+def safety_data_version(lat, lon, weather_ts, aqi_version):
+    """
+    Short opaque tag for the inputs of a location's score. Scores computed
+    from the same tag are identical, so it can serve as a response validator.
+    """
+    source = f"{SCORING_VERSION}|{SCORE_CACHE.generation}|{cache_key(lat, lon)}|{weather_ts!r}|{aqi_version}"
+    return hashlib.blake2b(source.encode(), digest_size=8).hexdigest()
+
+def get_safety_data_version(lat, lon):
+    """
+    safety_data_version of the inputs currently cached for a location, or
+    None if the weather or AQI data is not in the memory cache.
+    """
+    weather = WEATHER_CACHE.peek(lat, lon)
+    if weather is None:
+        return None
+    aqi_version = get_aqi_data_version(lat, lon)
+    if aqi_version is None:
+        return None
+    return safety_data_version(lat, lon, weather.ts, aqi_version)
 
 def get_weather_data(lat, lon, retry=0, max_retries=3):
     """
     Get current and forecast weather data from Open-Meteo API
     Uses caching and exponential backoff for rate limiting
     """
-    # Try cache first
-    cached = get_cached_weather_data(lat, lon)
+    # Try cache first; under load or upstream trouble this may be stale data
+    cached, may_fetch = admission.read_cache(WEATHER_CACHE, lat, lon, PROVIDER)
     if cached:
         return cached
+    if not may_fetch:
+        return get_weather_fallback("degraded")
     
     try:
         params = {
             "latitude": lat,
             "longitude": lon,
             "current": "temperature_2m,relative_humidity_2m,precipitation,rain,showers,snowfall,wind_speed_10m,wind_direction_10m,weather_code",
-            "hourly": "precipitation,weather_code",
             "timezone": "auto"
         }
         
-        response = requests.get(OPEN_METEO_BASE, params=params, timeout=8)
+        response = upstream.fetch(PROVIDER, get_settings().open_meteo_base, params=params, timeout=8, key=cache_key(lat, lon))
         
         # Handle rate limiting with retry
         if response.status_code == 429:
-            if retry < max_retries:
+            if retry < max_retries and admission.may_retry(PROVIDER):
                 wait_time = (2 ** retry) + 1  # Exponential backoff: 2, 4, 8 seconds
-                print(f"Rate limited on weather API, retrying in {wait_time}s (attempt {retry+1}/{max_retries})")
-                time.sleep(wait_time)
+                logger.warning("Rate limited on weather API, retrying in %ss (attempt %s/%s)", wait_time, retry + 1, max_retries)
+                UPSTREAM_RETRIES.inc(PROVIDER)
+                with timing.stage("retry_wait"):
+                    time.sleep(wait_time)
                 return get_weather_data(lat, lon, retry=retry+1, max_retries=max_retries)
             else:
-                print(f"Max retries exceeded for weather API at ({lat}, {lon})")
-                return get_weather_fallback()
+                logger.warning("Max retries exceeded for weather API at (%s, %s)", lat, lon)
+                return get_weather_fallback("rate_limited")
         
         response.raise_for_status()
         
-        data = response.json()
-        cache_weather_data(lat, lon, data)  # Cache the result
-        return data
+        try:
+            record = WeatherRecord.from_payload(response.json())
+        except ValueError as e:
+            # Don't cache or score defaults for a response without data
+            logger.warning("No weather data for (%s, %s): %s", lat, lon, e)
+            return get_weather_fallback("no_data")
+        cache_weather_data(lat, lon, record)  # Cache the result
+        return record
     
-    except requests.Timeout:
-        print(f"Weather API timeout for ({lat}, {lon}) - using fallback")
-        return get_weather_fallback()
+    except upstream.UpstreamTimeout:
+        logger.warning("Weather API timeout for (%s, %s) - using fallback", lat, lon)
+        return get_weather_fallback("timeout")
     except Exception as e:
-        print(f"Weather API error for ({lat}, {lon}): {e}")
-        return get_weather_fallback()
+        logger.warning("Weather API error for (%s, %s): %s", lat, lon, e)
+        return get_weather_fallback("error")
 
-def get_weather_fallback():
+def get_weather_fallback(reason="unavailable"):
     """
     Return default weather data when API is unavailable
     """
-    return {
-        "current": {
-            "temperature_2m": 20,
-            "relative_humidity_2m": 60,
-            "precipitation": 0,
-            "wind_speed_10m": 10,
-            "weather_code": 0
-        }
-    }
+    FALLBACKS_SERVED.inc(PROVIDER, reason)
+    return WeatherRecord(20, 60, 0, 10, 0, cache_time(), fallback=True)
 
 def interpret_weather_code(code):
     """
@@ -169,6 +187,72 @@ def interpret_weather_code(code):
     else:
         return "unknown", 0.1
 
+def score_components(weather_data, aq_reduction):
+    """
+    Numeric result of the scoring rules for one set of inputs:
+    (safety_score, weather code, wind, precipitation, humidity and
+    temperature impacts). This tuple is all SCORE_CACHE keeps per cell.
+    """
+    safety_score = 1.0
+    
+    # 1. Weather code impact (precipitation, storms, etc.) - STRICTER: 50% -> 55%
+    _, code_impact = interpret_weather_code(weather_data.weather_code)
+    safety_score -= code_impact * 0.55  # Weather impact is 55% of score (was 40%)
+    
+    # 2. Wind speed impact (km/h) - STRICTER
+    wind_speed = weather_data.wind_speed
+    if wind_speed > 40:
+        wind_impact = 0.4  # was 0.3
+    elif wind_speed > 20:
+        wind_impact = 0.2  # was 0.15
+    elif wind_speed > 10:
+        wind_impact = 0.1  # NEW threshold
+    else:
+        wind_impact = 0
+    safety_score -= wind_impact * 0.35  # Wind impact is 35% of score (was 30%)
+    
+    # 3. Precipitation amount (mm) - STRICTER
+    precipitation = weather_data.precipitation
+    if precipitation > 5:
+        precip_impact = 0.4  # was 0.3
+    elif precipitation > 2:
+        precip_impact = 0.25  # was 0.15
+    elif precipitation > 0.5:
+        precip_impact = 0.1  # NEW threshold
+    else:
+        precip_impact = 0
+    safety_score -= precip_impact * 0.25  # Precipitation impact is 25% of score (was 20%)
+    
+    # 4. Humidity (comfort and visibility) - STRICTER
+    humidity = weather_data.humidity
+    humidity_impact = 0
+    if humidity > 95:
+        humidity_impact = 0.15  # was 0.1
+    elif humidity > 85:
+        humidity_impact = 0.08  # NEW threshold
+    
+    safety_score -= humidity_impact * 0.15  # Humidity impact added (was optional)
+    
+    # 5. Temperature extremes - STRICTER
+    temperature = weather_data.temperature
+    temp_impact = 0
+    if temperature < -10 or temperature > 45:
+        temp_impact = 0.2  # was 0.1
+        safety_score -= temp_impact
+    elif temperature < 0 or temperature > 35:
+        temp_impact = 0.1  # was 0.05
+        safety_score -= temp_impact
+    elif temperature < 5 or temperature > 30:
+        temp_impact = 0.05  # NEW threshold
+        safety_score -= temp_impact
+    
+    # 6. Air Quality Impact - STRICTER: 20% -> 45%
+    safety_score -= aq_reduction * 0.45  # AQI impact is 45% of score (was 20%) - MAJOR INCREASE
+    
+    # Ensure score is within 0.05-1.0 range (stricter minimum)
+    safety_score = max(0.05, min(1.0, safety_score))
+    return safety_score, code_impact, wind_impact, precip_impact, humidity_impact, temp_impact
+
 def calculate_weather_safety_score(lat, lon):
     """
     Calculate safety score based on weather conditions and air quality
@@ -181,88 +265,52 @@ def calculate_weather_safety_score(lat, lon):
     - Air Quality Index (AQI) - poor air quality reduces safety (20% weight)
     
     Returns:
-        dict: Safety score (0-1, where 1 = safest) with detailed breakdown
+        dict: Safety score (0-1, where 1 = safest) with detailed breakdown.
+        "data_source" is "live" (real inputs, possibly cached), "partial"
+        (air quality lookup failed) or "fallback" (no weather data; the
+        score is a placeholder and the status UNKNOWN). "data_version" is
+        the safety_data_version of the records actually used, for live
+        results only
     """
     try:
         weather_data = get_weather_data(lat, lon)
         
-        if not weather_data or "current" not in weather_data:
-            print(f"No weather data for ({lat}, {lon})")
+        if weather_data is None or weather_data.fallback:
+            # Never score the built-in defaults: they read as clear, calm weather
+            logger.warning("No weather data for (%s, %s)", lat, lon)
             return {
                 "safety_score": 0.5,
+                "data_source": "fallback",
+                "description": "Weather data unavailable - safety unknown",
                 "error": "No weather data",
                 "weather_type": "unknown"
             }
         
-        current = weather_data["current"]
-        
-        safety_score = 1.0
-        
-        # 1. Weather code impact (precipitation, storms, etc.) - STRICTER: 50% -> 55%
-        weather_code = current.get("weather_code", 0)
-        weather_type, code_impact = interpret_weather_code(weather_code)
-        safety_score -= code_impact * 0.55  # Weather impact is 55% of score (was 40%)
-        
-        # 2. Wind speed impact (km/h) - STRICTER
-        wind_speed = current.get("wind_speed_10m", 0)
-        if wind_speed > 40:
-            wind_impact = 0.4  # was 0.3
-        elif wind_speed > 20:
-            wind_impact = 0.2  # was 0.15
-        elif wind_speed > 10:
-            wind_impact = 0.1  # NEW threshold
-        else:
-            wind_impact = 0
-        safety_score -= wind_impact * 0.35  # Wind impact is 35% of score (was 30%)
-        
-        # 3. Precipitation amount (mm) - STRICTER
-        precipitation = current.get("precipitation", 0)
-        if precipitation > 5:
-            precip_impact = 0.4  # was 0.3
-        elif precipitation > 2:
-            precip_impact = 0.25  # was 0.15
-        elif precipitation > 0.5:
-            precip_impact = 0.1  # NEW threshold
-        else:
-            precip_impact = 0
-        safety_score -= precip_impact * 0.25  # Precipitation impact is 25% of score (was 20%)
-        
-        # 4. Humidity (comfort and visibility) - STRICTER
-        humidity = current.get("relative_humidity_2m", 50)
-        humidity_impact = 0
-        if humidity > 95:
-            humidity_impact = 0.15  # was 0.1
-        elif humidity > 85:
-            humidity_impact = 0.08  # NEW threshold
-        
-        safety_score -= humidity_impact * 0.15  # Humidity impact added (was optional)
+        aq_data = get_air_quality_data(lat, lon)
+        aq_score = get_location_air_quality_score(lat, lon, aq_data)
+        aq_reduction = aq_score.get("safety_reduction", 0)
         
-        # 5. Temperature extremes - STRICTER
-        temperature = current.get("temperature_2m", 20)
-        temp_impact = 0
-        if temperature < -10 or temperature > 45:
-            temp_impact = 0.2  # was 0.1
-            safety_score -= temp_impact
-        elif temperature < 0 or temperature > 35:
-            temp_impact = 0.1  # was 0.05
-            safety_score -= temp_impact
-        elif temperature < 5 or temperature > 30:
-            temp_impact = 0.05  # NEW threshold
-            safety_score -= temp_impact
+        inputs = f"{SCORING_VERSION}|{weather_data.ts!r}|{aqi_input_version(aq_data)}"
+        components = SCORE_CACHE.get(lat, lon, inputs)
+        if components is None:
+            scoring_start = time.perf_counter()
+            components = score_components(weather_data, aq_reduction)
+            # A score without real AQI data must not replace a complete one
+            if not aq_data.fallback:
+                SCORE_CACHE.put(lat, lon, inputs, components)
+            timing.add("scoring", time.perf_counter() - scoring_start)
+        safety_score, code_impact, wind_impact, precip_impact, humidity_impact, temp_impact = components
         
-        # 6. Air Quality Impact - STRICTER: 20% -> 45%
-        aq_score = get_location_air_quality_score(lat, lon)
-        aq_reduction = aq_score.get("safety_reduction", 0)
+        weather_type, _ = interpret_weather_code(weather_data.weather_code)
+        temperature = weather_data.temperature
+        wind_speed = weather_data.wind_speed
+        humidity = weather_data.humidity
+        precipitation = weather_data.precipitation
         aq_warnings = aq_score.get("warnings", [])
         aq_pollutants = aq_score.get("pollutants", {})
         aq_available = aq_score.get("data_available", False)
         aq_location = aq_score.get("location_name", "Unknown")
         
-        safety_score -= aq_reduction * 0.45  # AQI impact is 45% of score (was 20%) - MAJOR INCREASE
-        
-        # Ensure score is within 0.05-1.0 range (stricter minimum)
-        safety_score = max(0.05, min(1.0, safety_score))
-        
         # Generate human-readable description
         description = f"Weather: {weather_type.capitalize()} | Temp: {temperature}°C | Wind: {wind_speed} km/h | Humidity: {humidity}% | Precipitation: {precipitation}mm"
         
@@ -272,6 +320,10 @@ def calculate_weather_safety_score(lat, lon):
         
         return {
             "safety_score": safety_score,
+            "data_source": "partial" if aq_data.fallback else "live",
+            "data_version": None if aq_data.fallback else safety_data_version(
+                lat, lon, weather_data.ts, aqi_data_version(aq_data)
+            ),
             "description": description,
             "weather_type": weather_type,
             "temperature": temperature,
@@ -295,13 +347,25 @@ def calculate_weather_safety_score(lat, lon):
         }
     
     except Exception as e:
-        print(f"Safety score calculation error: {e}")
+        logger.exception("Safety score calculation error")
         return {
             "safety_score": 0.5,
+            "data_source": "fallback",
             "error": str(e),
             "weather_type": "unknown"
         }
 
+def safety_status(safety_info):
+    """SAFE/MODERATE/RISKY from the score, or UNKNOWN if it was not computed from real weather"""
+    if safety_info.get("data_source") == "fallback":
+        return "UNKNOWN"
+    safety_score = safety_info.get("safety_score", 0.5)
+    if safety_score >= 0.7:
+        return "SAFE"
+    if safety_score >= 0.4:
+        return "MODERATE"
+    return "RISKY"
+
 def _score_waypoint(wp):
     lat = float(wp.get("lat"))
     lon = float(wp.get("lon"))
@@ -309,13 +373,7 @@ def _score_waypoint(wp):
 
     safety_info = calculate_weather_safety_score(lat, lon)
     safety_score = safety_info["safety_score"]
-
-    if safety_score >= 0.7:
-        status = "SAFE"
-    elif safety_score >= 0.4:
-        status = "MODERATE"
-    else:
-        status = "RISKY"
+    status = safety_status(safety_info)
 
     return {
         "lat": lat,
@@ -323,6 +381,7 @@ def _score_waypoint(wp):
         "name": name,
         "safety_score": safety_score,
         "status": status,
+        "data_source": safety_info.get("data_source", "live"),
         "description": safety_info.get("description", ""),
         "weather_type": safety_info.get("weather_type", "unknown"),
         "temperature": safety_info.get("temperature", 0),
@@ -342,40 +401,33 @@ def get_route_weather_safety(waypoints):
         waypoints (list): List of {'lat', 'lon', 'name'} dicts
 
     Returns:
-        dict: Safety analysis with individual waypoint scores and route status
+        dict: Safety analysis with individual waypoint scores and route status.
+        average_safety is weighted by the distance each waypoint covers;
+        see RouteAggregator.summary for the other aggregate fields.
     """
     try:
+        waypoint_results = []
+        unsafe_areas = []
+        aggregator = RouteAggregator()
         with ThreadPoolExecutor(max_workers=min(len(waypoints), 6)) as executor:
-            futures = {executor.submit(_score_waypoint, wp): i for i, wp in enumerate(waypoints)}
-            ordered = [None] * len(waypoints)
-            for future in as_completed(futures):
-                idx = futures[future]
-                ordered[idx] = future.result()
-
-        waypoint_results = [r for r in ordered if r is not None]
-        unsafe_areas = [r for r in waypoint_results if r["status"] != "SAFE"]
-        
-        # Calculate average safety
-        avg_safety = sum([w["safety_score"] for w in waypoint_results]) / len(waypoint_results) if waypoint_results else 0.5
-        
-        # Determine overall route status
-        if len(unsafe_areas) == 0:
-            route_status = "SAFE"
-        elif len(unsafe_areas) <= len(waypoint_results) / 2:
-            route_status = "MODERATE"
-        else:
-            route_status = "RISKY"
+            futures = [executor.submit(timing.bind(_score_waypoint), wp) for wp in waypoints]
+            # Consume in route order as results complete; aggregates are
+            # distance-weighted and built in this single pass
+            for future in futures:
+                result = future.result()
+                waypoint_results.append(result)
+                if result["status"] != "SAFE":
+                    unsafe_areas.append(result)
+                aggregator.add(result)
         
         return {
             "waypoints": waypoint_results,
-            "average_safety": avg_safety,
             "unsafe_areas": unsafe_areas,
-            "route_status": route_status,
-            "unsafe_count": len(unsafe_areas)
+            **aggregator.summary()
         }
     
     except Exception as e:
-        print(f"Route safety error: {e}")
+        logger.exception("Route safety error")
         return {
             "error": str(e),
             "waypoints": [],
@@ -116,7 +116,10 @@ export default function SafetyChecker({ trip, onSafetyCheck, onSafetyDataReceive
                   <div>
                     <p className="font-bold">Route Status: {safetyData.route_status}</p>
                     <p className="text-sm">
-                      Average Safety Score: {(safetyData.average_safety * 100).toFixed(1)}%
+                      Average Safety Score:{" "}
+                      {safetyData.average_safety == null
+                        ? "Unknown (no weather data)"
+                        : `${(safetyData.average_safety * 100).toFixed(1)}%`}
                     </p>
                   </div>
                 </div>
@@ -56,6 +56,7 @@ export default function TripTracking() {
   const geolocationRef = useRef(null);
   const safetyCheckIntervalRef = useRef(null);
   const currentLocationRef = useRef(null);
+  const lastSafetyRef = useRef({ etag: null, data: null });
 
   const token = localStorage.getItem("token");
 
@@ -88,6 +89,32 @@ export default function TripTracking() {
     }
   }, [tripId, token, navigate]);
 
+  // Restore safety checks recorded by the safety service (survives page reloads)
+  useEffect(() => {
+    if (!tripId || !token) return;
+    const fetchSafetyHistory = async () => {
+      try {
+        const res = await fetch(`${SAFETY_API_URL}/trips/${tripId}/history`, {
+          headers: { Authorization: token },
+        });
+        if (!res.ok) return;
+        const data = await res.json();
+        setSafetyHistory((prev) =>
+          prev.length > 0
+            ? prev
+            : data.points.map((point) => ({
+                score: point.score,
+                timestamp: point.ts * 1000,
+                location: { lat: point.lat, lng: point.lon },
+              }))
+        );
+      } catch (err) {
+        console.error("Safety history fetch error:", err);
+      }
+    };
+    fetchSafetyHistory();
+  }, [tripId, token]);
+
   // Fetch actual route from OSRM when trip loads
   useEffect(() => {
     if (!trip) return;
@@ -216,14 +243,21 @@ export default function TripTracking() {
       if (!loc) return; // location not yet acquired
 
       try {
+        // Send the last ETag so an unchanged score comes back as an empty 304
+        const lastSafety = lastSafetyRef.current;
+        // With the login token the safety service also stores this check in the trip's history
+        const headers = { "Content-Type": "application/json", Authorization: token };
+        if (lastSafety.etag) headers["If-None-Match"] = lastSafety.etag;
+
         const res = await fetch(`${SAFETY_API_URL}/safety_score`, {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ lat: loc.lat, lon: loc.lng }),
+          headers,
+          body: JSON.stringify({ lat: loc.lat, lon: loc.lng, trip_id: tripId }),
         });
 
-        if (res.ok) {
-          const data = await res.json();
+        if (res.ok || (res.status === 304 && lastSafety.data)) {
+          const data = res.status === 304 ? lastSafety.data : await res.json();
+          lastSafetyRef.current = { etag: res.headers.get("ETag") || lastSafety.etag, data };
           setSafetyScore(data.safety_score);
           setSafetyHistory((prev) => [
             ...prev,
@@ -753,12 +787,14 @@ export default function TripTracking() {
                     try {
                       const res = await fetch(`${SAFETY_API_URL}/safety_score`, {
                         method: "POST",
-                        headers: { "Content-Type": "application/json" },
+                        headers: { "Content-Type": "application/json", Authorization: token },
                         body: JSON.stringify({
                           lat: currentLocation.lat,
                           lon: currentLocation.lng,
+                          trip_id: tripId,
                         }),
                       });
+                      if (!res.ok) throw new Error(`HTTP ${res.status}`);
                       const data = await res.json();
                       setSafetyScore(data.safety_score);
                       setSafetyHistory((prev) => [